@@ -1,10 +1,56 @@
 '''Binary Ninja plugin for the Motorola M6800 processor'''
+from binaryninja import PluginCommand
+
 from .architecture import M6800
 from .binaryview import M6800BinaryView
+from .corpus import apply_corpus_names, record_view_names
+from .coverage import emulate_coverage
+from .inlineargs import register_settings
+from .ixprop import add_indexed_references
+from .ramusage import show_ram_usage
+
 
+# Register the inline argument table setting, read by every new BinaryView
+register_settings()
 
 # Register Architecture with Binary Ninja
 M6800.register()
 
 # Register BinaryView with Binary Ninja
 M6800BinaryView.register()
+
+# Register analysis commands with Binary Ninja
+PluginCommand.register(
+    'M6800\\RAM Usage Map',
+    'Show which functions read and write each RAM and CMOS variable',
+    show_ram_usage,
+    lambda view: view.view_type == M6800BinaryView.name
+)
+
+PluginCommand.register(
+    'M6800\\Emulate and Import Coverage',
+    'Run the ROM from reset and highlight the executed instructions by hit count',
+    emulate_coverage,
+    lambda view: view.view_type == M6800BinaryView.name
+)
+
+PluginCommand.register(
+    'M6800\\Add Names to Corpus Index',
+    'Index the routines of this ROM and record the names and types given to them',
+    record_view_names,
+    lambda view: view.view_type == M6800BinaryView.name
+)
+
+PluginCommand.register(
+    'M6800\\Apply Names from Corpus Index',
+    'Name the routines that match routines named in other ROMs of the corpus index',
+    apply_corpus_names,
+    lambda view: view.view_type == M6800BinaryView.name
+)
+
+PluginCommand.register(
+    'M6800\\Resolve Indexed References',
+    'Propagate constant IX values and add a reference from every resolvable indexed operand',
+    add_indexed_references,
+    lambda view: view.view_type == M6800BinaryView.name
+)
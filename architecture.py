@@ -1,14 +1,21 @@
 '''Binary Ninja architecture for the Motorola M6800 processor'''
 import struct
+import threading
 
 from binaryninja import (
     Architecture, RegisterInfo, FlagRole, LowLevelILFlagCondition, log_error, InstructionTextToken,
     InstructionTextTokenType as ITTT, InstructionInfo, BranchType,
-    LowLevelILFunction, LowLevelILLabel
+    LowLevelILFunction, LowLevelILLabel, Endianness
 )
 
-from .instructions import (AddressMode, InstructionType, INSTRUCTIONS, ADDRESS_MASK,
-                           BIGGER_LOADS, LLIL_OPERATIONS, REGISTER_OR_MEMORY_DESTINATIONS)
+from .inlineargs import inline_argument_length, MAX_INLINE_ARGUMENTS
+from .instructions import (AddressMode, InstructionType, OPCODE_TABLE, ADDRESS_MASK,
+                           BIGGER_LOADS, LLIL_OPERATIONS, MAX_INSTRUCTION_LENGTH,
+                           NZV_OVERWRITES, REGISTER_OR_MEMORY_DESTINATIONS, WORD_ARITHMETIC)
+
+# Decoded instructions, cached separately by every analysis thread so no lock is needed
+_DECODE_CACHE = threading.local()
+DECODE_CACHE_SIZE = 4096
 
 
 # pylint: disable=abstract-method
@@ -17,13 +24,17 @@ class M6800(Architecture):
     name = 'M6800'
     address_size = 2
     default_int_size = 2
+    # words are stored high byte first, which every 16 bit load and store in the IL relies on
+    endianness = Endianness.BigEndian
 
+    # sub register offsets count bytes up from the least significant, so ACCA is the high byte
     regs = {
         'SP': RegisterInfo('SP', 2),        # Stack Pointer
         'PC': RegisterInfo('PC', 2),        # Program Counter
         'IX': RegisterInfo('IX', 2),        # Index Register
-        'ACCA': RegisterInfo('ACCA', 1),    # Accumulator A
-        'ACCB': RegisterInfo('ACCB', 1)     # Accumulator B
+        'D': RegisterInfo('D', 2),          # ACCA:ACCB, only used by 16 bit idioms
+        'ACCA': RegisterInfo('D', 1, 1),    # Accumulator A
+        'ACCB': RegisterInfo('D', 1, 0)     # Accumulator B
     }
 
     flags = ['C', 'V', 'Z', 'N', 'I', 'H']
@@ -37,12 +48,13 @@ class M6800(Architecture):
         'H': FlagRole.HalfCarryFlagRole
     }
 
-    flag_write_types = ['', 'HNZVC', 'NZVC', 'NZV', 'Z']
+    flag_write_types = ['', 'HNZVC', 'NZVC', 'NZV', 'NVC', 'Z']
 
     flags_written_by_flag_write_type = {
         'HNZVC': ['H', 'N', 'Z', 'V', 'C'],
         'NZVC': ['N', 'Z', 'V', 'C'],
         'NZV': ['N', 'Z', 'V'],
+        'NVC': ['N', 'V', 'C'],
         'Z': ['Z']
     }
 
@@ -65,6 +77,9 @@ class M6800(Architecture):
 
     stack_pointer = 'SP'
 
+    # room for the parameter bytes some OS calls take inline
+    max_instr_length = MAX_INSTRUCTION_LENGTH + MAX_INLINE_ARGUMENTS
+
     # pylint: disable=invalid-name
     @staticmethod
     def _handle_jump(il: LowLevelILFunction, value):
@@ -101,13 +116,102 @@ class M6800(Architecture):
         if not false_label_found:
             il.mark_label(false_label)
 
+    @staticmethod
+    def _word_address(il, high, low):
+        '''Address expression of the word formed by two byte operands, or None.'''
+        (_, _, _, _, high_mode, high_value), (_, _, _, _, low_mode, low_value) = high, low
+        if high_mode != low_mode or low_value != high_value + 1:
+            return None
+        if high_mode in [AddressMode.DIRECT, AddressMode.EXTENDED]:
+            return il.const(2, high_value)
+        if high_mode == AddressMode.INDEXED:
+            return il.add(2, il.reg(2, 'IX'), il.const(1, high_value))
+        return None
+
+    @staticmethod
+    def _lift_word_idiom(il: LowLevelILFunction, data, addr, first):
+        '''Lift an ACCA:ACCB instruction pair as one operation on D, return its length or None.
+
+        Handles ADD/ADC and SUB/SBC on ACCB then ACCA, and LDA or STA of both accumulators
+        from or to adjacent bytes. Pairs are only fused when the second instruction is not a
+        branch target and the instruction after the pair makes the flags the idiom does not
+        compute, such as Z of the high byte, unobservable.
+        '''
+        first_length = first[1]
+        if il.get_label_for_address(Architecture['M6800'], addr + first_length) is not None:
+            return None
+        try:
+            second = M6800._decode_instruction(data[first_length:], addr + first_length)
+        except (LookupError, IndexError):
+            return None
+        length = first_length + second[1]
+        if length >= len(data):
+            return None
+        following = OPCODE_TABLE[data[length]]
+        following = None if following is None else following[0]
+
+        (nmemonic, _, register, _, mode, value) = first
+        (second_nmemonic, _, second_register, _, second_mode, second_value) = second
+
+        if (nmemonic, second_nmemonic) in WORD_ARITHMETIC:
+            # only DAA reads the half carry, which the 16 bit operation does not compute
+            if register != 'ACCB' or second_register != 'ACCA' or following == 'DAA':
+                return None
+            if mode == second_mode == AddressMode.IMMEDIATE:
+                operand = il.const(2, (second_value << 8) | value)
+            else:
+                address = M6800._word_address(il, second, first)
+                if address is None:
+                    return None
+                operand = il.load(2, address)
+            il.append(il.set_reg(2, 'D', WORD_ARITHMETIC[(nmemonic, second_nmemonic)](
+                il, operand)))
+            if following not in NZV_OVERWRITES:
+                il.append(il.set_flag('Z', il.compare_equal(
+                    1, il.reg(1, 'ACCA'), il.const(1, 0))))
+            return length
+
+        if nmemonic != second_nmemonic or nmemonic not in ['LDA', 'STA'] or \
+                {register, second_register} != {'ACCA', 'ACCB'} or \
+                following not in NZV_OVERWRITES:
+            return None
+        high, low = (first, second) if register == 'ACCA' else (second, first)
+        if nmemonic == 'LDA' and mode == second_mode == AddressMode.IMMEDIATE:
+            il.append(il.set_reg(2, 'D', il.const(2, (high[5] << 8) | low[5])))
+            return length
+        address = M6800._word_address(il, high, low)
+        if address is None:
+            return None
+        if nmemonic == 'LDA':
+            il.append(il.set_reg(2, 'D', il.load(2, address)))
+        else:
+            il.append(il.store(2, address, il.reg(2, 'D')))
+        return length
+
     @staticmethod
     def _decode_instruction(data, addr):
-        opcode = data[0]
         try:
-            nmemonic, inst_length, inst_operand, inst_type, mode = INSTRUCTIONS[opcode]
-        except KeyError:
+            cache = _DECODE_CACHE.entries
+        except AttributeError:
+            cache = _DECODE_CACHE.entries = {}
+
+        # the text, info and IL callbacks all decode the same instruction in turn
+        key = (addr, bytes(data[:MAX_INSTRUCTION_LENGTH]))
+        decoded = cache.get(key)
+        if decoded is None:
+            decoded = M6800._decode_uncached(data, addr)
+            if len(cache) >= DECODE_CACHE_SIZE:
+                cache.clear()
+            cache[key] = decoded
+        return decoded
+
+    @staticmethod
+    def _decode_uncached(data, addr):
+        opcode = data[0]
+        entry = OPCODE_TABLE[opcode]
+        if entry is None:
             raise LookupError(f'Opcode 0x{opcode:X} at address 0x{addr:X} is invalid.')
+        nmemonic, inst_length, inst_operand, inst_type, mode = entry
 
         value = None
 
@@ -146,6 +250,7 @@ class M6800(Architecture):
         except LookupError as error:
             log_error(error.__str__())
             return None
+        arguments = inline_argument_length(nmemonic, mode, value)
 
         tokens = [
             InstructionTextToken(ITTT.InstructionToken, nmemonic)
@@ -174,18 +279,28 @@ class M6800(Architecture):
             tokens.append(InstructionTextToken(ITTT.IntegerToken, f'0x{value:X}', value))
             tokens.append(InstructionTextToken(ITTT.EndMemoryOperandToken, ']'))
 
-        return tokens, inst_length
+        # show the inline parameters as part of the call
+        if arguments:
+            tokens.append(InstructionTextToken(ITTT.TextToken, ' {'))
+            for index, byte in enumerate(data[inst_length:inst_length + arguments]):
+                if index:
+                    tokens.append(InstructionTextToken(ITTT.OperandSeparatorToken, ', '))
+                tokens.append(InstructionTextToken(ITTT.IntegerToken, f'0x{byte:02X}', byte))
+            tokens.append(InstructionTextToken(ITTT.TextToken, '}'))
+
+        return tokens, inst_length + arguments
 
     def get_instruction_info(self, data, addr):
         try:
-            (_, inst_length, _,
+            (nmemonic, inst_length, _,
              inst_type, mode, value) = M6800._decode_instruction(data, addr)
         except LookupError as error:
             log_error(error.__str__())
             return None
 
+        # execution resumes after any inline parameters
         inst = InstructionInfo()
-        inst.length = inst_length
+        inst.length = inst_length + inline_argument_length(nmemonic, mode, value)
 
         if inst_type == InstructionType.CONDITIONAL_BRANCH:
             if mode == AddressMode.INDEXED:
@@ -216,6 +331,13 @@ class M6800(Architecture):
             log_error(error.__str__())
             return None
 
+        # 16 bit arithmetic and moves split across ACCB and ACCA lift to a single operation
+        if nmemonic in ['ADD', 'SUB', 'LDA', 'STA']:
+            fused_length = M6800._lift_word_idiom(
+                il, data, addr, (nmemonic, inst_length, inst_operand, inst_type, mode, value))
+            if fused_length is not None:
+                return fused_length
+
         # Figure out what the instruction uses
         load_size = 2 if nmemonic in BIGGER_LOADS else 1
         operand, second_operand = None, None
@@ -286,4 +408,4 @@ class M6800(Architecture):
         # Finally, calculate and append the instruction(s)
         il.append(operation)
 
-        return inst_length
+        return inst_length + inline_argument_length(nmemonic, mode, value)
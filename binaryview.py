@@ -1,9 +1,35 @@
 '''Binary View for the Motorola M6800 Processor'''
 import struct
 
-from binaryninja import (BinaryView, Architecture, SegmentFlag, SectionSemantics)
+from binaryninja import (BinaryView, Architecture, SegmentFlag, SectionSemantics, Type,
+                         Endianness)
 
-from .instructions import ADDRESS_MASK
+from .architecture import M6800
+from .cfg import build_cfg
+from .classifier import classify_regions, DATA
+from .inlineargs import inline_argument_length, load_settings
+from .instructions import (AddressMode, InstructionType, ADDRESS_MASK, INSTRUCTIONS,
+                           MAX_INSTRUCTION_LENGTH)
+from .layout import (RAM_START, RAM_SIZE, PROGRAM_MEMORY_START, PROGRAM_MEMORY_SIZE,
+                     CMOS_MEMORY_START, CMOS_MEMORY_SIZE, ROM_START, ROM_SIZE, GAME_OS_START,
+                     GAME_OS_SIZE, FLIPPER_OS_START, FLIPPER_OS_SIZE, VECTORS_START,
+                     VECTORS_SIZE)
+
+# Files scoring below this are not offered the M6800 view
+VALID_CONFIDENCE = 0.75
+
+# Instructions decoded, within the bytes read, at the reset target during detection
+DETECTION_SAMPLE_INSTRUCTIONS = 32
+DETECTION_SAMPLE_SIZE = DETECTION_SAMPLE_INSTRUCTIONS * MAX_INSTRUCTION_LENGTH
+
+# A jump or return this early at the reset target is suspicious
+DETECTION_MIN_INSTRUCTIONS = 6
+
+# Jumps into the ROM followed while sampling, so a reset trampoline is sampled at its target
+DETECTION_MAX_JUMPS = 2
+
+# Samples with more printable characters than this are text, not code
+TEXT_LIMIT = 0.9
 
 
 class M6800BinaryView(BinaryView):
@@ -17,16 +43,74 @@ class M6800BinaryView(BinaryView):
         self.raw = data
 
     @classmethod
-    def is_valid_for_data(self, unused_data):
-        return True
+    def is_valid_for_data(self, data):
+        return M6800BinaryView.detection_confidence(data) >= VALID_CONFIDENCE
+
+    @staticmethod
+    def detection_confidence(data):
+        '''Score between 0 and 1 of how much data looks like a pinball ROM image.
+
+        Half the score comes from the interrupt vectors pointing into the ROM, half from the
+        instructions at the reset target decoding. Only the vectors and DETECTION_SAMPLE_SIZE
+        bytes at the reset target, and at the targets of up to DETECTION_MAX_JUMPS jumps, are
+        read.
+        '''
+        if data.length < VECTORS_START + VECTORS_SIZE:
+            return 0.0
+        vectors = data.read(VECTORS_START, VECTORS_SIZE)
+        if len(vectors) != VECTORS_SIZE:
+            return 0.0
+
+        # erased or zeroed vectors mask into the address space without meaning anything
+        words = struct.unpack(f'>{VECTORS_SIZE // 2}H', vectors)
+        handlers = [word & ADDRESS_MASK for word in words if word not in [0x0000, 0xFFFF]]
+        in_rom = [ROM_START <= addr < VECTORS_START for addr in handlers]
+        reset = words[-1] & ADDRESS_MASK
+        if words[-1] in [0x0000, 0xFFFF] or not ROM_START <= reset < VECTORS_START:
+            return 0.0
+
+        sample = data.read(reset, DETECTION_SAMPLE_SIZE)
+        if not sample or sum(0x20 <= byte < 0x7F or byte in b'\t\r\n' for byte in sample) > \
+                TEXT_LIMIT * len(sample):
+            return 0.0
+
+        valid, offset, addr, jumps = 0, 0, reset, 0
+        for _ in range(DETECTION_SAMPLE_INSTRUCTIONS):
+            entry = INSTRUCTIONS.get(sample[offset]) if offset < len(sample) else None
+            if entry is None:
+                break
+            valid += 1
+            if entry[3] == InstructionType.UNCONDITIONAL_BRANCH and jumps < DETECTION_MAX_JUMPS \
+                    and entry[4] != AddressMode.INDEXED:
+                # keep sampling at the target of a jump into the ROM, such as JMP init
+                try:
+                    target = M6800._decode_instruction(
+                        sample[offset:offset + MAX_INSTRUCTION_LENGTH], addr + offset)[5]
+                except (LookupError, IndexError):
+                    target = None
+                if target is not None and ROM_START <= target < VECTORS_START:
+                    jumps += 1
+                    sample, offset, addr = data.read(target, DETECTION_SAMPLE_SIZE), 0, target
+                    continue
+            offset += entry[1]
+            if entry[3] in [InstructionType.UNCONDITIONAL_BRANCH, InstructionType.RETURN]:
+                break
+        # reset code sets up the stack and clears RAM before its first jump
+        needed = DETECTION_SAMPLE_INSTRUCTIONS if entry is None else DETECTION_MIN_INSTRUCTIONS
+        decoded = min(1.0, valid / needed)
+
+        return 0.5 * sum(in_rom) / (VECTORS_SIZE // 2) + 0.5 * decoded
 
     def init(self):
         self.platform = Architecture[M6800BinaryView.name].standalone_platform
         self.arch = Architecture[M6800BinaryView.name]
 
+        # Decode calls with the inline arguments configured, one table for every open view
+        load_settings()
+
         # Create RAM Segment
         self.add_auto_segment(
-            0, 0x200, 0, 0x200,
+            RAM_START, RAM_SIZE, RAM_START, RAM_SIZE,
             (SegmentFlag.SegmentContainsData |
              SegmentFlag.SegmentReadable |
              SegmentFlag.SegmentWritable)
@@ -34,17 +118,19 @@ class M6800BinaryView(BinaryView):
 
         # Create Program RAM Section
         self.add_auto_section(
-            'Program Memory', 0, 0x100, SectionSemantics.ReadWriteDataSectionSemantics
+            'Program Memory', PROGRAM_MEMORY_START, PROGRAM_MEMORY_SIZE,
+            SectionSemantics.ReadWriteDataSectionSemantics
         )
 
         # Create CMOS RAM Section
         self.add_auto_section(
-            'CMOS Memory', 0x100, 0x100, SectionSemantics.ReadWriteDataSectionSemantics
+            'CMOS Memory', CMOS_MEMORY_START, CMOS_MEMORY_SIZE,
+            SectionSemantics.ReadWriteDataSectionSemantics
         )
 
         # Create Exectuable Segment
         self.add_auto_segment(
-            0x5800, 0x2800, 0x5800, 0x2800,
+            ROM_START, ROM_SIZE, ROM_START, ROM_SIZE,
             (SegmentFlag.SegmentContainsCode |
              SegmentFlag.SegmentReadable |
              SegmentFlag.SegmentExecutable)
@@ -52,12 +138,14 @@ class M6800BinaryView(BinaryView):
 
         # Add Game OS Section
         self.add_auto_section(
-            'Game OS', 0x5800, 0x1000, SectionSemantics.ReadOnlyCodeSectionSemantics
+            'Game OS', GAME_OS_START, GAME_OS_SIZE,
+            SectionSemantics.ReadOnlyCodeSectionSemantics
         )
 
         # Add Flipper OS Section
         self.add_auto_section(
-            'Flipper OS', 0x6800, 0x1800, SectionSemantics.ReadOnlyCodeSectionSemantics
+            'Flipper OS', FLIPPER_OS_START, FLIPPER_OS_SIZE,
+            SectionSemantics.ReadOnlyCodeSectionSemantics
         )
 
         # Find the start address
@@ -65,13 +153,59 @@ class M6800BinaryView(BinaryView):
         entry_addr = struct.unpack(
             '>H', self.raw.read(start_address_pointer, 2))[0] & ADDRESS_MASK
 
+        # Keep Binary Ninja from decoding the tables, fonts and text in the ROM
+        self._define_data_regions()
+
         # Add the start address to the BinaryView
         self.add_entry_point(entry_addr)
+
+        # Type the inline arguments once the calls taking them have been found
+        self._inline_arguments_event = self.add_analysis_completion_event(
+            self._define_inline_arguments)
         return False
 
+    def _define_data_regions(self):
+        '''Create a data section and a byte array for every ROM region classified as data.'''
+        # everything reached from the vectors is code, whatever its bytes look like
+        image = self.raw.read(0, ADDRESS_MASK + 1).ljust(ADDRESS_MASK + 1, b'\x00')
+        instructions = [(inst.addr, inst.length) for function in build_cfg(image).values()
+                        for block in function.blocks.values() for inst in block.instructions]
+
+        for region in classify_regions(image[ROM_START:ROM_START + ROM_SIZE], ROM_START,
+                                       instructions):
+            if region.kind != DATA:
+                continue
+            length = region.end - region.start
+            self.add_auto_section(
+                f'Data 0x{region.start:04X}', region.start, length,
+                SectionSemantics.ReadOnlyDataSectionSemantics
+            )
+            self.define_auto_data_var(region.start, Type.array(Type.int(1, False), length))
+
+    def _define_inline_arguments(self):
+        '''Define a byte array over the parameters following every inline argument call.'''
+        for function in self.functions:
+            for block in function.basic_blocks:
+                addr = block.start
+                while addr < block.end:
+                    data = self.read(addr, MAX_INSTRUCTION_LENGTH)
+                    try:
+                        (nmemonic, inst_length, _,
+                         _, mode, value) = M6800._decode_instruction(data, addr)
+                    except LookupError:
+                        break
+                    arguments = inline_argument_length(nmemonic, mode, value)
+                    if arguments:
+                        self.define_auto_data_var(
+                            addr + inst_length, Type.array(Type.int(1, False), arguments))
+                    addr += inst_length + arguments
+
     def perform_get_address_size(self):
         return 2
 
+    def perform_get_default_endianness(self):
+        return Endianness.BigEndian
+
     def perform_is_executable(self):
         return True
 
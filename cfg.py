@@ -0,0 +1,140 @@
+'''Recursive descent function and basic block discovery over a raw M6800 ROM image'''
+import struct
+from collections import namedtuple
+
+from .architecture import M6800
+from .inlineargs import inline_argument_length, MAX_INLINE_ARGUMENTS
+from .instructions import AddressMode, InstructionType, ADDRESS_MASK, MAX_INSTRUCTION_LENGTH
+from .layout import ROM_START, ROM_SIZE, VECTORS_START, VECTORS_SIZE
+
+# A decoded instruction, fields as returned by M6800._decode_instruction except that length
+# and data include any inline parameter bytes
+Instruction = namedtuple('Instruction', ['addr', 'nmemonic', 'length', 'operand', 'inst_type',
+                                         'mode', 'value', 'data'])
+
+# A straight run of instructions, successors are the addresses control can flow to next
+BasicBlock = namedtuple('BasicBlock', ['start', 'end', 'instructions', 'successors'])
+
+# A discovered routine, blocks keyed by start address, callees and callers by entry address
+Function = namedtuple('Function', ['start', 'blocks', 'callees', 'callers'])
+
+
+def decode(image, addr):
+    '''Decode the instruction at addr in image, an address space sized bytes object.'''
+    data = bytes(image[addr:addr + MAX_INSTRUCTION_LENGTH + MAX_INLINE_ARGUMENTS])
+    try:
+        (nmemonic, inst_length, inst_operand,
+         inst_type, mode, value) = M6800._decode_instruction(data, addr)
+    except (LookupError, IndexError):
+        return None
+    inst_length += inline_argument_length(nmemonic, mode, value)
+    return Instruction(addr, nmemonic, inst_length, inst_operand, inst_type, mode, value,
+                       data[:inst_length])
+
+
+def vector_targets(image):
+    '''Return the IRQ, SWI, NMI and reset handler addresses.'''
+    vectors = bytes(image[VECTORS_START:VECTORS_START + VECTORS_SIZE])
+    return [addr & ADDRESS_MASK for addr in struct.unpack(f'>{len(vectors) // 2}H', vectors)]
+
+
+def _in_code(addr, start=ROM_START, end=ROM_START + ROM_SIZE):
+    return addr is not None and start <= addr < end
+
+
+def _flow(inst):
+    '''Return (successors, callee) for an instruction, ignoring targets outside the ROM.'''
+    fall_through = inst.addr + inst.length
+    known_target = inst.mode != AddressMode.INDEXED and _in_code(inst.value)
+
+    if inst.inst_type == InstructionType.CONDITIONAL_BRANCH:
+        return ([inst.value] if known_target else []) + [fall_through], None
+    if inst.inst_type == InstructionType.UNCONDITIONAL_BRANCH:
+        return ([inst.value] if known_target else []), None
+    if inst.inst_type == InstructionType.RETURN or inst.nmemonic == 'RTI':
+        return [], None
+    if inst.inst_type == InstructionType.CALL:
+        return [fall_through], inst.value if known_target else None
+    return [fall_through], None
+
+
+def _explore(image, entry):
+    '''Decode everything reachable from entry without following calls.
+
+    Returns the instructions by address, the block leaders and the callees.
+    '''
+    instructions, leaders, callees = {}, {entry}, set()
+    pending = [entry]
+    while pending:
+        addr = pending.pop()
+        while _in_code(addr) and addr not in instructions:
+            inst = decode(image, addr)
+            if inst is None:
+                break
+            instructions[addr] = inst
+            successors, callee = _flow(inst)
+            if callee is not None:
+                callees.add(callee)
+
+            if inst.inst_type in [InstructionType.CONDITIONAL_BRANCH,
+                                  InstructionType.UNCONDITIONAL_BRANCH]:
+                leaders.update(successors)
+                pending.extend(successors)
+                break
+            if not successors:
+                break
+            addr = successors[0]
+
+    return instructions, leaders, callees
+
+
+def _split(instructions, leaders):
+    '''Cut the explored instructions into basic blocks at the leaders.'''
+    blocks = {}
+    for leader in sorted(leader for leader in leaders if leader in instructions):
+        block, addr = [], leader
+        while addr in instructions and (addr == leader or addr not in leaders):
+            inst = instructions[addr]
+            block.append(inst)
+            successors, _ = _flow(inst)
+            if inst.inst_type in [InstructionType.CONDITIONAL_BRANCH,
+                                  InstructionType.UNCONDITIONAL_BRANCH] or not successors:
+                break
+            addr = successors[0]
+
+        last = block[-1]
+        successors = [target for target in _flow(last)[0] if target in instructions]
+        blocks[leader] = BasicBlock(leader, last.addr + last.length, tuple(block),
+                                    tuple(successors))
+    return blocks
+
+
+def build_cfg(image, entries=None):
+    '''Discover the functions reachable from entries, by default the interrupt vectors.
+
+    Every call target becomes a function of its own. Returns {entry address: Function}.
+    '''
+    pending = list(vector_targets(image) if entries is None else entries)
+    functions = {}
+    while pending:
+        entry = pending.pop()
+        if entry in functions or not _in_code(entry):
+            continue
+        instructions, leaders, callees = _explore(image, entry)
+        if entry not in instructions:
+            continue
+        functions[entry] = Function(entry, _split(instructions, leaders), callees, set())
+        pending.extend(callees)
+
+    for function in functions.values():
+        for callee in function.callees:
+            if callee in functions:
+                functions[callee].callers.add(function.start)
+    return functions
+
+
+def load_image(path):
+    '''Read a flat ROM file laid out by address, padded to the whole address space.'''
+    with open(path, 'rb') as rom_file:
+        image = rom_file.read(ADDRESS_MASK + 1)
+    return image.ljust(ADDRESS_MASK + 1, b'\x00')
@@ -0,0 +1,177 @@
+'''Code versus data classification of ROM regions ahead of analysis'''
+from collections import namedtuple
+from itertools import accumulate
+
+from .architecture import M6800
+from .inlineargs import inline_argument_length
+from .instructions import AddressMode, InstructionType, INSTRUCTIONS, MAX_INSTRUCTION_LENGTH
+
+# Windows of WINDOW bytes are scored every STRIDE bytes, each STRIDE chunk is labelled with
+# the average score of the windows covering it
+WINDOW = 64
+STRIDE = 16
+
+# Chunks scoring below this are data
+CODE_THRESHOLD = 0.5
+
+# Data runs shorter than this are left as code rather than fragmenting a routine
+MIN_DATA_LENGTH = 32
+
+CODE = 'code'
+DATA = 'data'
+
+# A classified [start, end) address range
+Region = namedtuple('Region', ['start', 'end', 'kind'])
+
+# Per byte translation tables, applied with bytes.translate
+TEXT_TABLE = bytes(1 if 0x20 <= byte < 0x7F else 0 for byte in range(0x100))
+FILL_TABLE = bytes(1 if byte in [0x00, 0xFF] else 0 for byte in range(0x100))
+ZERO_TABLE = bytes([1] + [0] * 0xFF)
+
+# Instructions whose decoded operand is a code address
+FLOW_TYPES = [InstructionType.CONDITIONAL_BRANCH, InstructionType.UNCONDITIONAL_BRANCH,
+              InstructionType.CALL]
+FLOW_MODES = [AddressMode.RELATIVE, AddressMode.EXTENDED]
+
+
+def _sweep(image, base):
+    '''Linear sweep over image, returning per byte flags as bytearrays.
+
+    starts marks instruction starts, invalid marks undecodable opcodes, branches marks
+    branches, jumps and calls with a known target and consistent marks those whose target is
+    an instruction start inside the image.
+    '''
+    size = len(image)
+    starts, invalid = bytearray(size), bytearray(size)
+    branches, consistent = bytearray(size), bytearray(size)
+    targets = []
+
+    offset = 0
+    while offset < size:
+        entry = INSTRUCTIONS.get(image[offset])
+        if entry is None:
+            invalid[offset] = 1
+            offset += 1
+            continue
+
+        starts[offset] = 1
+        nmemonic, inst_length, _, inst_type, mode = entry
+        value = None
+        if inst_type in FLOW_TYPES and mode in FLOW_MODES:
+            data = image[offset:offset + MAX_INSTRUCTION_LENGTH]
+            try:
+                value = M6800._decode_instruction(data, base + offset)[5]
+            except LookupError:
+                pass
+            targets.append((offset, value))
+        offset += inst_length + inline_argument_length(nmemonic, mode, value)
+
+    for offset, value in targets:
+        branches[offset] = 1
+        if value is not None and 0 <= value - base < size and starts[value - base]:
+            consistent[offset] = 1
+
+    return starts, invalid, branches, consistent
+
+
+def _repeats(image):
+    '''Flag every byte equal to the one before it, using one big integer exclusive or.'''
+    if len(image) < 2:
+        return bytes(len(image))
+    difference = (int.from_bytes(image[1:], 'big') ^ int.from_bytes(image[:-1], 'big'))
+    return b'\x00' + difference.to_bytes(len(image) - 1, 'big').translate(ZERO_TABLE)
+
+
+def _window_sums(flags, size):
+    '''Sum of flags over every window, as prefix sum differences.'''
+    prefix = list(accumulate(flags, initial=0))
+    return [prefix[min(start + WINDOW, size)] - prefix[start] for start in range(0, size, STRIDE)]
+
+
+def window_scores(image, base):
+    '''Code likelihood between 0 and 1 for the window starting at every STRIDE offset.'''
+    size = len(image)
+    starts, invalid, branches, consistent = _sweep(image, base)
+    columns = [_window_sums(flags, size) for flags in [
+        starts, invalid, branches, consistent, image.translate(TEXT_TABLE),
+        image.translate(FILL_TABLE), _repeats(image)
+    ]]
+
+    scores = []
+    for index, (start_count, invalid_count, branch_count, consistent_count,
+                text_count, fill_count, repeat_count) in enumerate(zip(*columns)):
+        length = min(WINDOW, size - index * STRIDE)
+
+        # a handful of invalid opcodes per window is already a strong data signal
+        validity = 1 - min(1, 4 * invalid_count / max(1, start_count + invalid_count))
+        flow = consistent_count / branch_count if branch_count else 0.5
+        texture = 1 - max(text_count, fill_count, repeat_count) / length
+        scores.append(0.4 * validity + 0.3 * flow + 0.3 * texture)
+
+    return scores
+
+
+def _trim(region, code, base):
+    '''Split a data region around the bytes flagged in code, which become code regions.'''
+    pieces = []
+    offset, end = region.start - base, region.end - base
+    while offset < end:
+        code_start = code.find(1, offset, end)
+        code_start = end if code_start < 0 else code_start
+        code_end = code.find(0, code_start, end)
+        code_end = end if code_end < 0 else code_end
+        if code_start > offset:
+            pieces.append(Region(base + offset, base + code_start, DATA))
+        if code_end > code_start:
+            pieces.append(Region(base + code_start, base + code_end, CODE))
+        offset = code_end
+    return pieces
+
+
+def classify_regions(image, base, instructions=()):
+    '''Split image, loaded at base, into code and data regions.
+
+    instructions holds the (address, length) of instructions known to be code, such as those
+    reached by recursive descent from the vectors. No data region overlaps any of them.
+    '''
+    size = len(image)
+    scores = window_scores(image, base)
+    windows_per_chunk = WINDOW // STRIDE
+
+    code = bytearray(size)
+    for addr, length in instructions:
+        offset = addr - base
+        if 0 <= offset < size:
+            end = min(offset + length, size)
+            code[offset:end] = b'\x01' * (end - offset)
+
+    labels = []
+    for chunk in range(len(scores)):
+        covering = scores[max(0, chunk - windows_per_chunk + 1):chunk + 1]
+        labels.append(CODE if sum(covering) / len(covering) >= CODE_THRESHOLD else DATA)
+
+    regions = []
+    for chunk, kind in enumerate(labels):
+        start = base + chunk * STRIDE
+        end = min(start + STRIDE, base + size)
+        if regions and regions[-1].kind == kind:
+            regions[-1] = regions[-1]._replace(end=end)
+        else:
+            regions.append(Region(start, end, kind))
+
+    # chunk labels are coarse, so cut known instructions out of the data at byte granularity
+    trimmed = []
+    for region in regions:
+        trimmed.extend(_trim(region, code, base) if region.kind == DATA else [region])
+
+    # fold short data runs back into the surrounding code
+    merged = []
+    for region in trimmed:
+        if region.kind == DATA and region.end - region.start < MIN_DATA_LENGTH:
+            region = region._replace(kind=CODE)
+        if merged and merged[-1].kind == region.kind:
+            merged[-1] = merged[-1]._replace(end=region.end)
+        else:
+            merged.append(region)
+
+    return merged
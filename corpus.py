@@ -0,0 +1,249 @@
+'''Cross-ROM routine deduplication with position independent block hashes and MinHash/LSH'''
+import hashlib
+import json
+import os
+import random
+from collections import namedtuple
+
+from binaryninja import get_open_filename_input, get_save_filename_input, log_info, log_error
+
+from .cfg import build_cfg, load_image
+from .instructions import AddressMode
+
+# MinHash signature length, split into BANDS bands of ROWS rows for locality sensitive hashing
+BANDS = 16
+ROWS = 4
+SIGNATURE_LENGTH = BANDS * ROWS
+
+# Mersenne prime modulus of the MinHash permutations
+PRIME = (1 << 61) - 1
+
+# Fixed permutations so signatures from different runs are comparable, multiplier and offset
+# drawn in turn from one seeded stream
+SEED = 0x6800
+_STREAM = random.Random(SEED)
+PERMUTATIONS = [(_STREAM.randrange(1, PRIME), _STREAM.randrange(PRIME))
+                for _ in range(SIGNATURE_LENGTH)]
+
+# Saved indexes hold signatures, so they must be rebuilt whenever the permutations change
+INDEX_VERSION = 2
+
+# Routines smaller than this match everywhere and are not indexed
+MIN_INSTRUCTIONS = 6
+
+# Estimated Jaccard similarity needed to call two routines the same
+SIMILARITY_THRESHOLD = 0.8
+
+# Operands that move when a routine is relocated or its variables are laid out differently
+POSITION_DEPENDENT_MODES = [AddressMode.DIRECT, AddressMode.EXTENDED, AddressMode.RELATIVE]
+
+# Indexed routine: a ROM id, an entry address, and the hashes used to match it
+Entry = namedtuple('Entry', ['rom', 'addr', 'exact', 'signature'])
+
+
+def _hash(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+def block_hash(block):
+    '''Hash a basic block with its DIRECT, EXTENDED and RELATIVE operands blanked out.
+
+    The opcode keeps the address mode, so only the position dependent values are dropped.
+    '''
+    normalised = bytearray()
+    for inst in block.instructions:
+        if inst.mode in POSITION_DEPENDENT_MODES:
+            normalised.append(inst.data[0])
+        else:
+            normalised += inst.data
+    return _hash(bytes(normalised))
+
+
+def features(function):
+    '''Shingles of a function: its block hashes and the hashes of its control flow edges.'''
+    hashes = {start: block_hash(block) for start, block in function.blocks.items()}
+    shingles = set(hashes.values())
+    for start, block in function.blocks.items():
+        for successor in block.successors:
+            if successor in hashes:
+                shingles.add(_hash(f'{hashes[start]}>{hashes[successor]}'.encode()))
+    return shingles
+
+
+def minhash(shingles):
+    '''MinHash signature of a set of 64 bit shingles.'''
+    return tuple(min((multiplier * shingle + offset) % PRIME for shingle in shingles)
+                 for multiplier, offset in PERMUTATIONS)
+
+
+def similarity(left, right):
+    '''Estimated Jaccard similarity of two signatures.'''
+    return sum(1 for a, b in zip(left, right) if a == b) / SIGNATURE_LENGTH
+
+
+class CorpusIndex:
+    '''MinHash/LSH index of the routines of many ROMs.
+
+    Routines land in one bucket per band, so a query only compares against routines sharing
+    at least one band instead of scanning the corpus. Names and types recorded for one routine
+    propagate to every near duplicate. Entry addresses are also kept per ROM, so propagating
+    names to one ROM never walks the others.
+    '''
+
+    def __init__(self):
+        self.entries = {}
+        self.roms = {}
+        self.buckets = {}
+        self.annotations = {}
+
+    def add_rom(self, rom, image):
+        '''Discover and index every routine of a ROM image, return the number indexed.'''
+        indexed = 0
+        for addr, function in build_cfg(image).items():
+            if sum(len(block.instructions) for block in function.blocks.values()) < \
+                    MIN_INSTRUCTIONS:
+                continue
+            hashes = sorted(block_hash(block) for block in function.blocks.values())
+            exact = _hash(json.dumps(hashes).encode())
+            self._insert(Entry(rom, addr, exact, minhash(features(function))))
+            indexed += 1
+        return indexed
+
+    def _insert(self, entry):
+        self.entries[(entry.rom, entry.addr)] = entry
+        self.roms.setdefault(entry.rom, set()).add(entry.addr)
+        for band in range(BANDS):
+            key = (band,) + entry.signature[band * ROWS:(band + 1) * ROWS]
+            self.buckets.setdefault(key, set()).add((entry.rom, entry.addr))
+
+    def matches(self, rom, addr, threshold=SIMILARITY_THRESHOLD):
+        '''Return [(similarity, rom, addr)] of the near duplicates in other ROMs, best first.'''
+        entry = self.entries.get((rom, addr))
+        if entry is None:
+            return []
+
+        candidates = set()
+        for band in range(BANDS):
+            key = (band,) + entry.signature[band * ROWS:(band + 1) * ROWS]
+            candidates.update(self.buckets.get(key, ()))
+
+        found = []
+        for key in candidates:
+            if key[0] == rom:
+                continue
+            other = self.entries[key]
+            score = 1.0 if other.exact == entry.exact else similarity(entry.signature,
+                                                                      other.signature)
+            if score >= threshold:
+                found.append((score, other.rom, other.addr))
+        found.sort(key=lambda match: (-match[0], match[1], match[2]))
+        return found
+
+    def annotate(self, rom, addr, name, type_string=None):
+        '''Record the name, and optionally the C type, given to a routine after analysis.'''
+        self.annotations[(rom, addr)] = (name, type_string)
+
+    def propagate(self, rom, threshold=SIMILARITY_THRESHOLD):
+        '''Return {addr: (name, type, similarity, source rom)} for the routines of rom that
+        match an annotated routine elsewhere.'''
+        result = {}
+        for addr in sorted(self.roms.get(rom, ())):
+            if (rom, addr) in self.annotations:
+                continue
+            for score, other_rom, other_addr in self.matches(rom, addr, threshold):
+                if (other_rom, other_addr) in self.annotations:
+                    name, type_string = self.annotations[(other_rom, other_addr)]
+                    result[addr] = (name, type_string, score, other_rom)
+                    break
+        return result
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf8') as index_file:
+            json.dump({
+                'version': INDEX_VERSION,
+                'entries': [[entry.rom, entry.addr, entry.exact, list(entry.signature)]
+                            for entry in self.entries.values()],
+                'annotations': [[rom, addr, name, type_string] for (rom, addr), (
+                    name, type_string) in self.annotations.items()]
+            }, index_file)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, encoding='utf8') as index_file:
+            data = json.load(index_file)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f'{path} was saved with other MinHash permutations, rebuild it')
+        for rom, addr, exact, signature in data['entries']:
+            index._insert(Entry(rom, addr, exact, tuple(signature)))
+        for rom, addr, name, type_string in data['annotations']:
+            index.annotate(rom, addr, name, type_string)
+        return index
+
+    @classmethod
+    def build(cls, paths):
+        '''Index a list of flat ROM files, using the file name as the ROM id.'''
+        index = cls()
+        for path in paths:
+            index.add_rom(os.path.basename(path), load_image(path))
+        return index
+
+
+def _rom_id(view):
+    return os.path.basename(view.file.original_filename)
+
+
+def _load_index(path):
+    '''Load a corpus index, logging and returning None if it has to be rebuilt.'''
+    try:
+        return CorpusIndex.load(path)
+    except ValueError as error:
+        log_error(str(error))
+        return None
+
+
+def record_view_names(view):
+    '''PluginCommand callback adding this ROM and its named functions to a corpus index.'''
+    path = get_save_filename_input('Corpus index', 'json')
+    if not path:
+        return
+    index = _load_index(path) if os.path.exists(path) else CorpusIndex()
+    if index is None:
+        return
+    rom = _rom_id(view)
+    index.add_rom(rom, view.parent_view.read(0, view.parent_view.length))
+    for function in view.functions:
+        if function.symbol.auto:
+            continue
+        index.annotate(rom, function.start, function.name, str(function.type))
+    index.save(path)
+
+
+def apply_corpus_names(view):
+    '''PluginCommand callback naming the functions that match annotated routines elsewhere.'''
+    path = get_open_filename_input('Corpus index', '*.json')
+    if not path:
+        return
+    index = _load_index(path)
+    if index is None:
+        return
+    rom = _rom_id(view)
+    index.add_rom(rom, view.parent_view.read(0, view.parent_view.length))
+
+    names = index.propagate(rom)
+
+    # create every missing function first, so analysis only has to run once
+    missing = [addr for addr in names if view.get_function_at(addr) is None]
+    for addr in missing:
+        view.add_function(addr)
+    if missing:
+        view.update_analysis_and_wait()
+
+    for addr, (name, type_string, score, source) in names.items():
+        function = view.get_function_at(addr)
+        if function is None:
+            continue
+        function.name = name
+        if type_string:
+            function.type = view.parse_type_string(type_string)[0]
+        log_info(f'0x{addr:04X} named {name} from {source} ({score:.0%} similar)')
@@ -0,0 +1,153 @@
+'''Import emulator execution coverage into the M6800 BinaryView'''
+from binaryninja import HighlightStandardColor, get_int_input, log_warn
+
+from .cfg import decode
+from .classifier import classify_regions, DATA
+from .emulator import M6800Emulator, EmulationError, MEMORY_SIZE
+from .instructions import InstructionType, INSTRUCTIONS
+from .layout import ROM_START, ROM_SIZE
+from .peripherals import attach_williams_io
+
+# Tag type used for the hottest instructions
+COVERAGE_TAG_TYPE = 'Coverage'
+COVERAGE_TAG_ICON = '🔥'
+
+# Highlight per heat bucket, hottest first
+HEAT_COLORS = [
+    HighlightStandardColor.RedHighlightColor,
+    HighlightStandardColor.OrangeHighlightColor,
+    HighlightStandardColor.YellowHighlightColor
+]
+
+# Instruction types after which execution never falls through to the next address
+NO_FALL_THROUGH = [InstructionType.UNCONDITIONAL_BRANCH, InstructionType.RETURN]
+
+# Erased EPROM and zero padding, never the start of a routine
+FILL_BYTES = [0x00, 0xFF]
+
+# Instructions that must decode in a row at a candidate, unless one of them ends the routine
+CANDIDATE_DECODE_LENGTH = 4
+
+
+def hottest(counts, start=ROM_START, end=ROM_START + ROM_SIZE):
+    '''Return (address, count) for every executed address in [start, end), hottest first.'''
+    executed = [(addr, counts[addr]) for addr in range(start, end) if counts[addr]]
+    executed.sort(key=lambda item: (-item[1], item[0]))
+    return executed
+
+
+def covered_bytes(counts, image, start=ROM_START, end=ROM_START + ROM_SIZE):
+    '''Return a bytearray flagging every byte that belongs to an executed instruction.'''
+    covered = bytearray(len(counts))
+    for addr in range(start, end):
+        if counts[addr]:
+            for byte in range(addr, min(addr + INSTRUCTIONS[image[addr]][1], len(covered))):
+                covered[byte] = 1
+    return covered
+
+
+def _decodes_linearly(image, addr, end):
+    '''Whether a few instructions decode in a row at addr without running into padding.'''
+    for _ in range(CANDIDATE_DECODE_LENGTH):
+        if addr >= end or image[addr] in FILL_BYTES:
+            return False
+        inst = decode(image, addr)
+        if inst is None:
+            return False
+        if inst.inst_type in NO_FALL_THROUGH or inst.nmemonic == 'RTI':
+            return True
+        addr += inst.length
+    return True
+
+
+def candidate_entry_points(counts, image, start=ROM_START, end=ROM_START + ROM_SIZE):
+    '''Return the start of every coverage gap that looks like an unreached routine.
+
+    A gap qualifies when the executed instruction before it cannot fall through into it, the
+    classifier does not label it data, and a few instructions decode there without hitting
+    padding. Skipped branch paths, fill and data tables are left out.
+    '''
+    covered = covered_bytes(counts, image, start, end)
+    executed = [(addr, INSTRUCTIONS[image[addr]][1]) for addr in range(start, end)
+                if counts[addr]]
+    data = bytearray(len(covered))
+    for region in classify_regions(image[start:end], start, executed):
+        if region.kind == DATA:
+            data[region.start:region.end] = b'\x01' * (region.end - region.start)
+
+    candidates = []
+    last_executed = None
+    for addr in range(start, end):
+        if counts[addr]:
+            last_executed = addr
+        if covered[addr] or (addr > start and not covered[addr - 1]):
+            continue
+
+        # addr starts a gap, check the instruction that ends right before it
+        if last_executed is None or data[addr] or not _decodes_linearly(image, addr, end):
+            continue
+        nmemonic, _, _, inst_type, _ = INSTRUCTIONS[image[last_executed]]
+        if inst_type in NO_FALL_THROUGH or nmemonic == 'RTI':
+            candidates.append(addr)
+
+    return candidates
+
+
+def apply_coverage(view, counts, tag_limit=64):
+    '''Push execution counts into the view, hottest first.
+
+    Every executed instruction inside a function is highlighted by heat bucket and the
+    tag_limit hottest ones are tagged with their hit count. Everything is computed up front
+    and then written in one pass over the affected functions.
+    '''
+    executed = hottest(counts)
+    if not executed:
+        return
+
+    if COVERAGE_TAG_TYPE not in view.tag_types:
+        view.create_tag_type(COVERAGE_TAG_TYPE, COVERAGE_TAG_ICON)
+
+    # bucket by rank so the hottest third is red, the next third orange and so on
+    bucket_size = len(executed) // len(HEAT_COLORS) + 1
+    annotations = []
+    for rank, (addr, count) in enumerate(executed):
+        for function in view.get_functions_containing(addr):
+            annotations.append((function, addr, count, HEAT_COLORS[rank // bucket_size],
+                                rank < tag_limit))
+
+    for function, addr, count, color, tagged in annotations:
+        function.set_auto_instr_highlight(addr, color)
+        if tagged:
+            function.add_tag(COVERAGE_TAG_TYPE, f'{count} hits', addr, auto=True)
+
+
+def add_candidate_functions(view, counts):
+    '''Create functions at the candidate entry points not already covered by analysis.'''
+    # the raw view is laid out by address and has no holes between the segments, but a short
+    # file ends before the vectors, so pad it like cfg.load_image
+    image = view.parent_view.read(0, MEMORY_SIZE).ljust(MEMORY_SIZE, b'\x00')
+    candidates = [addr for addr in candidate_entry_points(counts, image)
+                  if not view.get_functions_containing(addr)]
+    for addr in candidates:
+        view.add_function(addr)
+    return candidates
+
+
+def emulate_coverage(view):
+    '''PluginCommand callback running the ROM from reset and importing the coverage.
+
+    The Williams PIAs and periodic IRQ are attached, so the OS scanning done in the IRQ
+    handler shows up in the coverage.
+    '''
+    cycles = get_int_input('Cycles to emulate', 'M6800 Coverage')
+    if not cycles:
+        return
+
+    emulator = M6800Emulator(view.parent_view.read(0, MEMORY_SIZE))
+    io = attach_williams_io(emulator)
+    try:
+        io.scheduler.run(emulator, cycles)
+    except EmulationError as error:
+        log_warn(f'Emulation stopped early: {error}')
+    apply_coverage(view, emulator.counts)
+    add_candidate_functions(view, emulator.counts)
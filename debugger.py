@@ -0,0 +1,184 @@
+'''Breakpoints and memory watchpoints for the M6800 emulator'''
+from collections import namedtuple
+
+from .emulator import EmulationError, EmulatorWrapper
+from .instructions import ADDRESS_MASK
+from .layout import (PROGRAM_MEMORY_START, PROGRAM_MEMORY_SIZE, CMOS_MEMORY_START,
+                     CMOS_MEMORY_SIZE, ROM_START, ROM_SIZE)
+from .memory import MEMORY_SIZE, PAGE_SHIFT, PAGE_SIZE, PAGE_MASK
+
+# Regions that may be watched, by the section names of the M6800 BinaryView
+REGIONS = {
+    'Program Memory': (PROGRAM_MEMORY_START, PROGRAM_MEMORY_SIZE),
+    'CMOS Memory': (CMOS_MEMORY_START, CMOS_MEMORY_SIZE),
+    'ROM': (ROM_START, ROM_SIZE)
+}
+
+BREAKPOINT = 'breakpoint'
+READ = 'read'
+WRITE = 'write'
+
+# Why execution stopped: the kind, the address hit, the instruction and the value accessed
+Stop = namedtuple('Stop', ['kind', 'addr', 'pc', 'value'])
+
+
+class DebugStop(EmulationError):
+    '''Raised between instructions when a breakpoint or watchpoint is hit.'''
+
+    def __init__(self, stops):
+        super().__init__(', '.join(f'{stop.kind} at 0x{stop.addr:04X}' for stop in stops))
+        self.stops = stops
+
+
+class WatchPage:
+    '''Page handler flagging watched bytes, in front of the page's own handler if it has one.'''
+
+    def __init__(self, debugger, index, inner):
+        self.debugger = debugger
+        self.memory = debugger.emulator.memory
+        self.index = index
+        self.inner = inner
+        self.reads = bytearray(PAGE_SIZE)
+        self.writes = bytearray(PAGE_SIZE)
+
+    def read(self, addr):
+        if self.inner is None:
+            value = self.memory.pages[self.index][addr & PAGE_MASK]
+        else:
+            value = self.inner.read(addr)
+        if self.reads[addr & PAGE_MASK]:
+            self.debugger.hit(READ, addr, value)
+        return value
+
+    def write(self, addr, value):
+        if self.writes[addr & PAGE_MASK]:
+            self.debugger.hit(WRITE, addr, value)
+        if self.inner is None:
+            self.memory.store(addr, value)
+        else:
+            self.inner.write(addr, value)
+
+    def is_empty(self):
+        return not any(self.reads) and not any(self.writes)
+
+
+class Debugger(EmulatorWrapper):
+    '''Breakpoints as a bitmap over the address space, watchpoints as page handlers.
+
+    Nothing is checked while nothing is armed: step is the emulator's own step and run its
+    own run. Arming a breakpoint swaps in a step that tests the bitmap, and watching an
+    address wraps only its page, so every other page keeps the plain access path.
+
+    Watch pages wrap the handler a page has when the watch is armed, so map devices first.
+    Run by a peripherals.Scheduler, the debugger stops it by raising DebugStop.
+    '''
+
+    def __init__(self, emulator):
+        super().__init__(emulator)
+        self.breakpoints = bytearray(MEMORY_SIZE)
+        self.breakpoint_count = 0
+        self.watch_pages = {}
+        self.hits = []
+        self.stop = None
+        self._pc = None
+        self._resume = None
+        self.step = emulator.step
+
+    @property
+    def armed(self):
+        return bool(self.breakpoint_count or self.watch_pages)
+
+    def _rearm(self):
+        self.step = self._step_armed if self.armed else self.emulator.step
+
+    @staticmethod
+    def _check(start, length):
+        for region_start, region_size in REGIONS.values():
+            if region_start <= start and start + length <= region_start + region_size:
+                return
+        raise ValueError(f'0x{start:04X}+{length} is outside the RAM, CMOS and ROM regions')
+
+    def add_breakpoint(self, addr):
+        addr &= ADDRESS_MASK
+        self._check(addr, 1)
+        if not self.breakpoints[addr]:
+            self.breakpoints[addr] = 1
+            self.breakpoint_count += 1
+        self._rearm()
+
+    def remove_breakpoint(self, addr):
+        addr &= ADDRESS_MASK
+        if self.breakpoints[addr]:
+            self.breakpoints[addr] = 0
+            self.breakpoint_count -= 1
+        self._rearm()
+
+    def watch(self, start, length=1, read=False, write=True):
+        '''Stop after any instruction reading or writing a byte of [start, start + length).'''
+        self._check(start, length)
+        handlers = self.emulator.memory.handlers
+        for addr in range(start, start + length):
+            index = addr >> PAGE_SHIFT
+            page = self.watch_pages.get(index)
+            if page is None:
+                page = self.watch_pages[index] = WatchPage(self, index, handlers[index])
+                handlers[index] = page
+            page.reads[addr & PAGE_MASK] |= read
+            page.writes[addr & PAGE_MASK] |= write
+        self._rearm()
+
+    def watch_region(self, name, read=False, write=True):
+        '''Watch a whole region of REGIONS, such as the CMOS memory.'''
+        start, size = REGIONS[name]
+        self.watch(start, size, read, write)
+
+    def unwatch(self, start, length=1):
+        '''Remove any watch on [start, start + length), unwrapping pages left unwatched.'''
+        handlers = self.emulator.memory.handlers
+        for addr in range(start, start + length):
+            index = addr >> PAGE_SHIFT
+            page = self.watch_pages.get(index)
+            if page is None:
+                continue
+            page.reads[addr & PAGE_MASK] = 0
+            page.writes[addr & PAGE_MASK] = 0
+            if page.is_empty():
+                handlers[index] = page.inner
+                del self.watch_pages[index]
+        self._rearm()
+
+    def hit(self, kind, addr, value):
+        self.hits.append(Stop(kind, addr, self._pc, value))
+
+    def _step_armed(self):
+        emulator = self.emulator
+        pc = emulator.regs['PC']
+        if self.breakpoints[pc] and pc != self._resume:
+            # stop before the instruction, and run it when execution resumes here
+            self._resume = pc
+            raise DebugStop([Stop(BREAKPOINT, pc, pc, None)])
+        self._resume = None
+        self._pc = pc
+
+        cycles = emulator.step()
+        if self.hits:
+            hits, self.hits = self.hits, []
+            raise DebugStop(hits)
+        return cycles
+
+    def run(self, instructions):
+        '''Execute up to the given number of instructions, return the number executed.
+
+        stop holds the reason execution stopped early, or None.
+        '''
+        self.stop = None
+        if not self.armed:
+            return self.emulator.run(instructions)
+        return super().run(instructions)
+
+    def _completed(self, error):
+        if not isinstance(error, DebugStop):
+            return 0
+        self.stop = error
+        # a watchpoint stops after its instruction has completed
+        return 0 if error.stops[0].kind == BREAKPOINT else 1
@@ -0,0 +1,231 @@
+'''Structural diff of the routines of two ROM revisions'''
+import argparse
+import json
+import sys
+import time
+from collections import Counter, namedtuple
+
+from .cfg import build_cfg, load_image
+from .corpus import block_hash
+from .instructions import AddressMode, InstructionType, INSTRUCTIONS
+
+UNCHANGED = 'unchanged'
+MOVED = 'moved'
+CHANGED = 'changed'
+ADDED = 'added'
+REMOVED = 'removed'
+
+# Instructions whose RELATIVE or EXTENDED operand is a code address, which moves with the
+# routines
+FLOW_TYPES = [InstructionType.CONDITIONAL_BRANCH, InstructionType.UNCONDITIONAL_BRANCH,
+              InstructionType.CALL]
+
+# One line of the report, old or new is None for added and removed routines
+Change = namedtuple('Change', ['status', 'old', 'new', 'similarity'])
+
+
+class Fingerprint:
+    '''Relocation insensitive summary of a routine: its block hashes and call graph edges.
+
+    The hashes blank every address operand, so they only align routines. Whether a routine
+    changed is decided on its instructions.
+    '''
+
+    def __init__(self, function):
+        self.start = function.start
+        self.function = function
+        self.blocks = Counter(block_hash(block) for block in function.blocks.values())
+        self.exact = hash(tuple(sorted(self.blocks.elements())))
+        self.callees = function.callees
+        self.callers = function.callers
+
+    def similarity(self, other):
+        '''Jaccard similarity of the block hash multisets.'''
+        union = sum((self.blocks | other.blocks).values())
+        return sum((self.blocks & other.blocks).values()) / union if union else 1.0
+
+
+def fingerprints(image):
+    return {start: Fingerprint(function) for start, function in build_cfg(image).items()}
+
+
+class RomDiff:
+    '''Aligns the routines of an old and a new image without comparing their bytes in order.
+
+    Routines whose block hashes match and are unique on both sides anchor the alignment.
+    Routines called by or calling an aligned pair are then paired most similar first, then in
+    address order, which follows edits through the call graph however much a routine changed.
+    Leftovers at the same address are paired last.
+    '''
+
+    def __init__(self, old, new):
+        self.old = fingerprints(old)
+        self.new = fingerprints(new)
+        self.pairs = {}
+        self._align()
+
+    def _align(self):
+        old_by_hash = Counter(fingerprint.exact for fingerprint in self.old.values())
+        new_by_hash = {}
+        for start, fingerprint in self.new.items():
+            new_by_hash.setdefault(fingerprint.exact, []).append(start)
+
+        for start, fingerprint in self.old.items():
+            candidates = new_by_hash.get(fingerprint.exact, [])
+            if old_by_hash[fingerprint.exact] == 1 and len(candidates) == 1:
+                self.pairs[start] = candidates[0]
+
+        pending = list(self.pairs.items())
+        while pending:
+            old_start, new_start = pending.pop()
+            for relation in ['callees', 'callers']:
+                for old, new in self._match_neighbours(
+                        getattr(self.old[old_start], relation),
+                        getattr(self.new[new_start], relation)):
+                    self.pairs[old] = new
+                    pending.append((old, new))
+
+        matched_new = set(self.pairs.values())
+        for start in self.old:
+            if start not in self.pairs and start in self.new and start not in matched_new:
+                self.pairs[start] = start
+
+    def _match_neighbours(self, old_starts, new_starts):
+        '''Greedily pair unaligned routines of old_starts and new_starts, most similar first.
+
+        Routines sharing no block are paired too, in address order, as they still sit in the
+        same place of the call graph.
+        '''
+        matched_new = set(self.pairs.values())
+        old_starts = [start for start in old_starts if start in self.old and
+                      start not in self.pairs]
+        new_starts = [start for start in new_starts if start in self.new and
+                      start not in matched_new]
+
+        scored = []
+        for old in old_starts:
+            for new in new_starts:
+                scored.append((self.old[old].similarity(self.new[new]), old, new))
+        scored.sort(key=lambda item: (-item[0], item[1], item[2]))
+
+        used_old, used_new = set(), set()
+        for _, old, new in scored:
+            if old not in used_old and new not in used_new:
+                used_old.add(old)
+                used_new.add(new)
+                yield old, new
+
+    def _same_code(self, old, new):
+        '''Whether two paired routines have the same instructions.
+
+        Data addresses must be equal. Branch and call targets, relative or absolute, must be the
+        same place in the routine, or the paired routine, so moved routines are not changed.
+        '''
+        old_blocks = self.old[old].function.blocks
+        new_blocks = self.new[new].function.blocks
+        delta = new - old
+        if len(old_blocks) != len(new_blocks):
+            return False
+        inside = {inst.addr for block in old_blocks.values() for inst in block.instructions}
+        for start, block in old_blocks.items():
+            other = new_blocks.get(start + delta)
+            if other is None or len(block.instructions) != len(other.instructions):
+                return False
+            for inst, other_inst in zip(block.instructions, other.instructions):
+                if inst.inst_type not in FLOW_TYPES or inst.mode == AddressMode.INDEXED:
+                    if inst.data != other_inst.data:
+                        return False
+                    continue
+                # the opcode and any inline arguments must match, the target may move
+                operand_end = INSTRUCTIONS[inst.data[0]][1]
+                if (inst.data[0] != other_inst.data[0] or
+                        inst.data[operand_end:] != other_inst.data[operand_end:]):
+                    return False
+                if inst.value in inside:
+                    target = inst.value + delta
+                else:
+                    target = self.pairs.get(inst.value, inst.value)
+                if other_inst.value != target:
+                    return False
+        return True
+
+    def changes(self):
+        '''Every routine of both images as a Change, ordered by address.'''
+        changes = []
+        for old, new in self.pairs.items():
+            score = self.old[old].similarity(self.new[new])
+            if not self._same_code(old, new):
+                status = CHANGED
+            else:
+                status = UNCHANGED if old == new else MOVED
+            changes.append(Change(status, old, new, score))
+
+        matched_new = set(self.pairs.values())
+        changes.extend(Change(REMOVED, start, None, 0.0)
+                       for start in self.old if start not in self.pairs)
+        changes.extend(Change(ADDED, None, start, 0.0)
+                       for start in self.new if start not in matched_new)
+        changes.sort(key=lambda change: (change.new if change.old is None else change.old))
+        return changes
+
+
+def summary(changes):
+    return dict(Counter(change.status for change in changes))
+
+
+def report(changes, include_unchanged=False):
+    '''Render a diff as text, one routine per line.'''
+    lines = []
+    for change in changes:
+        if change.status == UNCHANGED and not include_unchanged:
+            continue
+        old = '' if change.old is None else f'0x{change.old:04X}'
+        new = '' if change.new is None else f'0x{change.new:04X}'
+        lines.append(f'{change.status:<10} {old:>6} -> {new:<6} {change.similarity:>5.0%}')
+    lines.append(', '.join(f'{count} {status}' for status, count in summary(changes).items()))
+    return '\n'.join(lines)
+
+
+def diff_files(old_path, new_path):
+    return RomDiff(load_image(old_path), load_image(new_path)).changes()
+
+
+def export(pairs, path):
+    '''Diff every (old, new) pair of ROM files and write the results as one JSON document.'''
+    results = []
+    for old_path, new_path in pairs:
+        started = time.perf_counter()
+        changes = diff_files(old_path, new_path)
+        results.append({
+            'old': old_path,
+            'new': new_path,
+            'seconds': round(time.perf_counter() - started, 3),
+            'summary': summary(changes),
+            'routines': [change._asdict() for change in changes]
+        })
+    with open(path, 'w', encoding='utf8') as output:
+        json.dump(results, output, indent=1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List the routines changed between ROM revisions')
+    parser.add_argument('roms', nargs='+', help='old and new image, or a chain of revisions')
+    parser.add_argument('--json', help='write every diff to this file instead')
+    parser.add_argument('--all', action='store_true', help='also list unchanged routines')
+    args = parser.parse_args()
+    if len(args.roms) < 2:
+        parser.error('need at least two images')
+
+    pairs = list(zip(args.roms, args.roms[1:]))
+    if args.json:
+        export(pairs, args.json)
+        return 0
+    for old_path, new_path in pairs:
+        print(f'{old_path} -> {new_path}')
+        print(report(diff_files(old_path, new_path), args.all))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,566 @@
+'''Instruction level emulator for the Motorola M6800 built on the opcode tables'''
+from array import array
+from collections import namedtuple
+
+from .architecture import M6800
+from .instructions import AddressMode, INSTRUCTIONS, ADDRESS_MASK
+from .memory import PagedMemory, MEMORY_SIZE
+
+# Interrupt vectors, masked into the address space like the reset vector in the BinaryView
+IRQ_VECTOR = 0xFFF8 & ADDRESS_MASK
+SWI_VECTOR = 0xFFFA & ADDRESS_MASK
+NMI_VECTOR = 0xFFFC & ADDRESS_MASK
+RESET_VECTOR = 0xFFFE & ADDRESS_MASK
+
+# Bits of the condition code register, named after M6800.flags
+FLAG_BITS = {'C': 0x01, 'V': 0x02, 'Z': 0x04, 'N': 0x08, 'I': 0x10, 'H': 0x20}
+C, V, Z, N, I, H = (FLAG_BITS[flag] for flag in ['C', 'V', 'Z', 'N', 'I', 'H'])
+
+# The two top bits of the condition code register always read as ones
+CCR_UNUSED = 0xC0
+
+# Cycles taken to stack the registers and fetch a vector
+INTERRUPT_CYCLES = 12
+
+# These instructions read, modify and write back an accumulator or memory byte
+READ_MODIFY_WRITE = ['ASL', 'ASR', 'CLR', 'COM', 'DEC', 'INC', 'LSR', 'NEG', 'ROL', 'ROR', 'TST']
+
+# Inherent instructions taking four cycles, everything else inherent takes two
+SLOW_INHERENT = {'INX': 4, 'DEX': 4, 'INS': 4, 'DES': 4, 'TSX': 4, 'TXS': 4,
+                 'RTS': 5, 'WAI': 9, 'RTI': 10, 'SWI': 12}
+
+
+# Machine state captured by M6800Emulator.snapshot
+Snapshot = namedtuple('Snapshot', ['pages', 'regs', 'ccr', 'cycles', 'waiting', 'irq_line',
+                                   'nmi_pending'])
+
+
+class EmulationError(Exception):
+    '''Raised when the emulated program executes something the M6800 cannot.'''
+
+
+def _cycles(nmemonic, mode):
+    '''Number of machine cycles the instruction takes.'''
+    # pylint: disable=too-many-return-statements
+    if mode == AddressMode.IMPLIED:
+        return SLOW_INHERENT.get(nmemonic, 2)
+    if mode == AddressMode.ACCUMULATOR:
+        return 4 if nmemonic in ['PSH', 'PUL'] else 2
+    if mode == AddressMode.RELATIVE:
+        return 8 if nmemonic == 'BSR' else 4
+    if nmemonic in ['JMP', 'JSR']:
+        return {AddressMode.INDEXED: {'JMP': 4, 'JSR': 8},
+                AddressMode.EXTENDED: {'JMP': 3, 'JSR': 9}}[mode][nmemonic]
+
+    # every other instruction costs a base per address mode plus extra bus cycles
+    base = {AddressMode.IMMEDIATE: 2, AddressMode.DIRECT: 3,
+            AddressMode.EXTENDED: 4, AddressMode.INDEXED: 5}[mode]
+    if nmemonic in READ_MODIFY_WRITE:
+        return base + 2
+    if nmemonic in ['STS', 'STX']:
+        return base + 2
+    if nmemonic in ['STA', 'CPX', 'LDS', 'LDX']:
+        return base + 1
+    return base
+
+
+# Flag helpers
+def _logic(emu, result):
+    '''Set N and Z from an 8 bit result and clear V.'''
+    emu.ccr = (emu.ccr & ~(N | Z | V)) | (result & 0x80 and N) | (Z if result == 0 else 0)
+    return result
+
+
+def _logic_word(emu, result):
+    '''Set N and Z from a 16 bit result and clear V.'''
+    emu.ccr = ((emu.ccr & ~(N | Z | V)) | (result & 0x8000 and N) |
+               (Z if result == 0 else 0))
+    return result
+
+
+def _add(emu, left, right, carry):
+    '''8 bit addition setting H, N, Z, V and C.'''
+    total = left + right + carry
+    result = total & 0xFF
+    emu.ccr = ((emu.ccr & ~(H | N | Z | V | C)) |
+               (H if (left & 0xF) + (right & 0xF) + carry > 0xF else 0) |
+               (result & 0x80 and N) | (Z if result == 0 else 0) |
+               (V if ~(left ^ right) & (left ^ result) & 0x80 else 0) |
+               (C if total > 0xFF else 0))
+    return result
+
+
+def _subtract(emu, left, right, borrow):
+    '''8 bit subtraction setting N, Z, V and C.'''
+    total = left - right - borrow
+    result = total & 0xFF
+    emu.ccr = ((emu.ccr & ~(N | Z | V | C)) |
+               (result & 0x80 and N) | (Z if result == 0 else 0) |
+               (V if (left ^ right) & (left ^ result) & 0x80 else 0) |
+               (C if total < 0 else 0))
+    return result
+
+
+def _step_flags(emu, value, step):
+    '''INC and DEC: set N, Z and V, leave C alone.'''
+    result = (value + step) & 0xFF
+    overflow = value == (0x7F if step > 0 else 0x80)
+    emu.ccr = ((emu.ccr & ~(N | Z | V)) | (result & 0x80 and N) | (Z if result == 0 else 0) |
+               (V if overflow else 0))
+    return result
+
+
+def _less(ccr):
+    '''Signed less than, N exclusive or V.'''
+    return bool(ccr & N) != bool(ccr & V)
+
+
+def _shift_flags(emu, result, carry):
+    '''Set N, Z and C from a shift or rotate, V is N exclusive or C.'''
+    negative = 1 if result & 0x80 else 0
+    emu.ccr = ((emu.ccr & ~(N | Z | V | C)) | (negative and N) | (Z if result == 0 else 0) |
+               (V if negative ^ carry else 0) | (carry and C))
+    return result
+
+
+# Stack helpers
+def _push(emu, value):
+    regs = emu.regs
+    emu.write(regs['SP'], value)
+    regs['SP'] = (regs['SP'] - 1) & 0xFFFF
+
+
+def _pull(emu):
+    regs = emu.regs
+    regs['SP'] = (regs['SP'] + 1) & 0xFFFF
+    return emu.read(regs['SP'])
+
+
+def _push_word(emu, value):
+    _push(emu, value & 0xFF)
+    _push(emu, value >> 8)
+
+
+def _pull_word(emu):
+    return (_pull(emu) << 8) | _pull(emu)
+
+
+def _push_state(emu):
+    '''Stack every register the way SWI, WAI and interrupts do.'''
+    regs = emu.regs
+    _push_word(emu, regs['PC'])
+    _push_word(emu, regs['IX'])
+    _push(emu, regs['ACCA'])
+    _push(emu, regs['ACCB'])
+    _push(emu, emu.ccr | CCR_UNUSED)
+
+
+# Instruction handlers, called as handler(emu, operand, effective_address)
+def _read_modify_write(operation):
+    '''Apply operation to an accumulator or to the byte at the effective address.'''
+    def handler(emu, operand, ea):
+        if ea is None:
+            result = operation(emu, emu.regs[operand])
+            if result is not None:
+                emu.regs[operand] = result
+        else:
+            result = operation(emu, emu.read(ea))
+            if result is not None:
+                emu.write(ea, result)
+    return handler
+
+
+def _accumulator(operation):
+    '''Apply operation to the accumulator operand and the byte at the effective address.'''
+    def handler(emu, operand, ea):
+        result = operation(emu, emu.regs[operand], emu.read(ea))
+        if result is not None:
+            emu.regs[operand] = result
+    return handler
+
+
+def _branch(condition):
+    '''Take the branch when condition holds for the condition code register.'''
+    def handler(emu, _, ea):
+        if condition(emu.ccr):
+            emu.regs['PC'] = ea
+    return handler
+
+
+def _flag(bit, value):
+    def handler(emu, _, __):
+        emu.ccr = (emu.ccr | bit) if value else (emu.ccr & ~bit)
+    return handler
+
+
+def _store(emu, operand, ea):
+    emu.write(ea, _logic(emu, emu.regs[operand]))
+
+
+def _store_word(register):
+    def handler(emu, _, ea):
+        value = _logic_word(emu, emu.regs[register])
+        emu.write(ea, value >> 8)
+        emu.write((ea + 1) & ADDRESS_MASK, value & 0xFF)
+    return handler
+
+
+def _load_word(register):
+    def handler(emu, _, ea):
+        emu.regs[register] = _logic_word(emu, emu.read_word(ea))
+    return handler
+
+
+def _compare_index(emu, _, ea):
+    '''CPX: Z from the whole word, N and V from the high bytes only.'''
+    index, value = emu.regs['IX'], emu.read_word(ea)
+    left, right = index >> 8, value >> 8
+    high = (left - right) & 0xFF
+    emu.ccr = ((emu.ccr & ~(N | Z | V)) | (high & 0x80 and N) |
+               (Z if index == value else 0) |
+               (V if (left ^ right) & (left ^ high) & 0x80 else 0))
+
+
+def _decimal_adjust(emu, _, __):
+    accumulator, ccr = emu.regs['ACCA'], emu.ccr
+    correction, carry = 0, ccr & C
+    if ccr & H or accumulator & 0xF > 9:
+        correction |= 0x06
+    if carry or accumulator >> 4 > 9 or (accumulator >> 4 > 8 and accumulator & 0xF > 9):
+        correction |= 0x60
+        carry = C
+    total = accumulator + correction
+    result = total & 0xFF
+    emu.regs['ACCA'] = result
+    emu.ccr = ((ccr & ~(N | Z | V | C)) | (result & 0x80 and N) | (Z if result == 0 else 0) |
+               carry | (C if total > 0xFF else 0))
+
+
+def _clear(emu, _):
+    emu.ccr = (emu.ccr & ~(N | V | C)) | Z
+    return 0
+
+
+def _complement(emu, value):
+    emu.ccr |= C
+    return _logic(emu, value ^ 0xFF)
+
+
+def _test(emu, value):
+    _logic(emu, value)
+    emu.ccr &= ~C
+
+
+def _bit_test(emu, accumulator, value):
+    _logic(emu, accumulator & value)
+
+
+def _compare(emu, accumulator, value):
+    _subtract(emu, accumulator, value, 0)
+
+
+def _pull_register(emu, operand, _):
+    emu.regs[operand] = _pull(emu)
+
+
+def _transfer_to_flags(emu, _, __):
+    emu.ccr = emu.regs['ACCA'] & ~CCR_UNUSED
+
+
+def _jump(emu, _, ea):
+    emu.regs['PC'] = ea
+
+
+def _call(emu, _, ea):
+    _push_word(emu, emu.regs['PC'])
+    emu.regs['PC'] = ea
+
+
+def _return(emu, _, __):
+    emu.regs['PC'] = _pull_word(emu) & ADDRESS_MASK
+
+
+def _return_from_interrupt(emu, _, __):
+    regs = emu.regs
+    emu.ccr = _pull(emu) & ~CCR_UNUSED
+    regs['ACCB'] = _pull(emu)
+    regs['ACCA'] = _pull(emu)
+    regs['IX'] = _pull_word(emu)
+    regs['PC'] = _pull_word(emu) & ADDRESS_MASK
+
+
+def _software_interrupt(emu, _, __):
+    _push_state(emu)
+    emu.ccr |= I
+    emu.regs['PC'] = emu.read_word(SWI_VECTOR) & ADDRESS_MASK
+
+
+def _wait(emu, _, __):
+    _push_state(emu)
+    emu.waiting = True
+
+
+def _set_register(register, function):
+    def handler(emu, _, __):
+        emu.regs[register] = function(emu)
+    return handler
+
+
+def _index_step(step):
+    def handler(emu, _, __):
+        value = (emu.regs['IX'] + step) & 0xFFFF
+        emu.regs['IX'] = value
+        emu.ccr = (emu.ccr & ~Z) | (Z if value == 0 else 0)
+    return handler
+
+
+HANDLERS = {
+    'ABA': _set_register('ACCA', lambda emu: _add(emu, emu.regs['ACCA'], emu.regs['ACCB'], 0)),
+    'ADC': _accumulator(lambda emu, acc, value: _add(emu, acc, value, emu.ccr & C)),
+    'ADD': _accumulator(lambda emu, acc, value: _add(emu, acc, value, 0)),
+    'AND': _accumulator(lambda emu, acc, value: _logic(emu, acc & value)),
+    'ASL': _read_modify_write(lambda emu, value: _shift_flags(
+        emu, (value << 1) & 0xFF, value >> 7)),
+    'ASR': _read_modify_write(lambda emu, value: _shift_flags(
+        emu, (value >> 1) | (value & 0x80), value & 1)),
+    'BCC': _branch(lambda ccr: not ccr & C),
+    'BCS': _branch(lambda ccr: ccr & C),
+    'BEQ': _branch(lambda ccr: ccr & Z),
+    'BGE': _branch(lambda ccr: not _less(ccr)),
+    'BGT': _branch(lambda ccr: not ccr & Z and not _less(ccr)),
+    'BHI': _branch(lambda ccr: not ccr & (C | Z)),
+    'BIT': _accumulator(_bit_test),
+    'BLE': _branch(lambda ccr: ccr & Z or _less(ccr)),
+    'BLS': _branch(lambda ccr: ccr & (C | Z)),
+    'BLT': _branch(_less),
+    'BMI': _branch(lambda ccr: ccr & N),
+    'BNE': _branch(lambda ccr: not ccr & Z),
+    'BPL': _branch(lambda ccr: not ccr & N),
+    'BRA': _jump,
+    'BSR': _call,
+    'BVC': _branch(lambda ccr: not ccr & V),
+    'BVS': _branch(lambda ccr: ccr & V),
+    'CBA': lambda emu, _, __: _compare(emu, emu.regs['ACCA'], emu.regs['ACCB']),
+    'CLC': _flag(C, False),
+    'CLI': _flag(I, False),
+    'CLR': _read_modify_write(_clear),
+    'CLV': _flag(V, False),
+    'CMP': _accumulator(_compare),
+    'COM': _read_modify_write(_complement),
+    'CPX': _compare_index,
+    'DAA': _decimal_adjust,
+    'DEC': _read_modify_write(lambda emu, value: _step_flags(emu, value, -1)),
+    'DES': _set_register('SP', lambda emu: (emu.regs['SP'] - 1) & 0xFFFF),
+    'DEX': _index_step(-1),
+    'EOR': _accumulator(lambda emu, acc, value: _logic(emu, acc ^ value)),
+    'INC': _read_modify_write(lambda emu, value: _step_flags(emu, value, 1)),
+    'INS': _set_register('SP', lambda emu: (emu.regs['SP'] + 1) & 0xFFFF),
+    'INX': _index_step(1),
+    'JMP': _jump,
+    'JSR': _call,
+    'LDA': _accumulator(lambda emu, acc, value: _logic(emu, value)),
+    'LDS': _load_word('SP'),
+    'LDX': _load_word('IX'),
+    'LSR': _read_modify_write(lambda emu, value: _shift_flags(emu, value >> 1, value & 1)),
+    'NEG': _read_modify_write(lambda emu, value: _subtract(emu, 0, value, 0)),
+    'NOP': lambda emu, _, __: None,
+    'ORA': _accumulator(lambda emu, acc, value: _logic(emu, acc | value)),
+    'PSH': lambda emu, operand, _: _push(emu, emu.regs[operand]),
+    'PUL': _pull_register,
+    'ROL': _read_modify_write(lambda emu, value: _shift_flags(
+        emu, ((value << 1) | (emu.ccr & C)) & 0xFF, value >> 7)),
+    'ROR': _read_modify_write(lambda emu, value: _shift_flags(
+        emu, (value >> 1) | ((emu.ccr & C) << 7), value & 1)),
+    'RTI': _return_from_interrupt,
+    'RTS': _return,
+    'SBA': _set_register('ACCA', lambda emu: _subtract(
+        emu, emu.regs['ACCA'], emu.regs['ACCB'], 0)),
+    'SBC': _accumulator(lambda emu, acc, value: _subtract(emu, acc, value, emu.ccr & C)),
+    'SEC': _flag(C, True),
+    'SEI': _flag(I, True),
+    'SEV': _flag(V, True),
+    'STA': _store,
+    'STS': _store_word('SP'),
+    'STX': _store_word('IX'),
+    'SUB': _accumulator(lambda emu, acc, value: _subtract(emu, acc, value, 0)),
+    'SWI': _software_interrupt,
+    'TAB': _set_register('ACCB', lambda emu: _logic(emu, emu.regs['ACCA'])),
+    'TAP': _transfer_to_flags,
+    'TBA': _set_register('ACCA', lambda emu: _logic(emu, emu.regs['ACCB'])),
+    'TPA': _set_register('ACCA', lambda emu: emu.ccr | CCR_UNUSED),
+    'TST': _read_modify_write(_test),
+    'TSX': _set_register('IX', lambda emu: (emu.regs['SP'] + 1) & 0xFFFF),
+    'TXS': _set_register('SP', lambda emu: (emu.regs['IX'] - 1) & 0xFFFF),
+    'WAI': _wait,
+}
+
+
+def _build_dispatch():
+    '''One (handler, length, operand, mode, cycles) entry per opcode, None if invalid.'''
+    dispatch = [None] * 0x100
+    for opcode, (nmemonic, inst_length, inst_operand, _, mode) in INSTRUCTIONS.items():
+        dispatch[opcode] = (HANDLERS[nmemonic], inst_length, inst_operand, mode,
+                            _cycles(nmemonic, mode))
+    return tuple(dispatch)
+
+
+DISPATCH = _build_dispatch()
+
+
+class Runner:
+    '''The run loop shared by the emulator and everything wrapping its step.'''
+
+    def run(self, instructions):
+        '''Execute up to the given number of instructions, return the number executed.'''
+        step = self.step
+        for executed in range(instructions):
+            try:
+                step()
+            except EmulationError as error:
+                return executed + self._completed(error)
+        return instructions
+
+    def _completed(self, unused_error):
+        '''Number of instructions, 0 or 1, the step that raised error completed.'''
+        return 0
+
+
+class EmulatorWrapper(Runner):
+    '''Base for tools wrapping an emulator's step, such as the profiler and the debugger.
+
+    A wrapper has the step, run and cycles of the emulator, so it can stand in for it with
+    a peripherals.Scheduler.
+    '''
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    @property
+    def cycles(self):
+        return self.emulator.cycles
+
+
+class M6800Emulator(Runner):
+    '''Emulates the M6800 over a flat image laid out like the M6800 BinaryView.
+
+    Registers live in regs, keyed like M6800.regs, the condition code register in ccr.
+    counts holds the number of times each address started an instruction.
+    '''
+
+    def __init__(self, image=b'', memory=None):
+        self.memory = PagedMemory(image) if memory is None else memory
+        self.read = self.memory.read
+        self.write = self.memory.write
+        self.fetch = self.memory.fetch
+        self.counts = array('I', bytes(4 * MEMORY_SIZE))
+        # D only exists in the lifted IL, the emulator keeps the accumulators apart
+        self.regs = dict.fromkeys((reg for reg in M6800.regs if reg != 'D'), 0)
+        self.ccr = I
+        self.cycles = 0
+        self.waiting = False
+        self.irq_line = False
+        self.nmi_pending = False
+        # called with no arguments whenever the CPU takes an IRQ
+        self.acknowledge = None
+        self.reset()
+
+    def read_word(self, addr):
+        return (self.read(addr) << 8) | self.read(addr + 1)
+
+    @property
+    def flags(self):
+        '''The condition code register split into the flags named in M6800.flags.'''
+        return {flag: 1 if self.ccr & FLAG_BITS[flag] else 0 for flag in M6800.flags}
+
+    def reset(self):
+        '''Jump through the reset vector with interrupts masked.'''
+        self.ccr |= I
+        self.waiting = False
+        self.regs['PC'] = self.read_word(RESET_VECTOR) & ADDRESS_MASK
+
+    def snapshot(self):
+        '''Capture the machine state, sharing every memory page until one side writes it.
+
+        Execution counts are instrumentation and are not part of the snapshot.
+        '''
+        return Snapshot(self.memory.snapshot(), dict(self.regs), self.ccr, self.cycles,
+                        self.waiting, self.irq_line, self.nmi_pending)
+
+    def restore(self, snapshot):
+        '''Return to a snapshot, copying back only the pages written since it was taken.'''
+        self.memory.restore(snapshot.pages)
+        self.regs.update(snapshot.regs)
+        self.ccr = snapshot.ccr
+        self.cycles = snapshot.cycles
+        self.waiting = snapshot.waiting
+        self.irq_line = snapshot.irq_line
+        self.nmi_pending = snapshot.nmi_pending
+
+    def irq(self, asserted=True):
+        '''Drive the level triggered IRQ line.'''
+        self.irq_line = asserted
+
+    def nmi(self):
+        '''Latch a non-maskable interrupt.'''
+        self.nmi_pending = True
+
+    def _interrupt(self):
+        '''Enter a pending interrupt, return the cycles taken or 0 if none was taken.'''
+        if self.nmi_pending:
+            vector = NMI_VECTOR
+            self.nmi_pending = False
+        elif self.irq_line and not self.ccr & I:
+            vector = IRQ_VECTOR
+            if self.acknowledge is not None:
+                self.acknowledge()
+        else:
+            return 0
+
+        # WAI already stacked the registers
+        if not self.waiting:
+            _push_state(self)
+        self.waiting = False
+        self.ccr |= I
+        self.regs['PC'] = self.read_word(vector) & ADDRESS_MASK
+        self.cycles += INTERRUPT_CYCLES
+        return INTERRUPT_CYCLES
+
+    def step(self):
+        '''Execute one instruction, or enter one interrupt, and return the cycles taken.'''
+        if self.nmi_pending or self.irq_line or self.waiting:
+            cycles = self._interrupt()
+            if cycles:
+                return cycles
+            if self.waiting:
+                self.cycles += 1
+                return 1
+
+        regs = self.regs
+        pc = regs['PC']
+        fetch = self.fetch
+        opcode = fetch(pc)
+        entry = DISPATCH[opcode]
+        if entry is None:
+            raise EmulationError(f'Opcode 0x{opcode:X} at address 0x{pc:X} is invalid.')
+        handler, inst_length, inst_operand, mode, cycles = entry
+
+        # calculate the effective address for each address mode, None if there is none
+        if mode == AddressMode.IMMEDIATE:
+            ea = (pc + 1) & ADDRESS_MASK
+        elif mode == AddressMode.DIRECT:
+            ea = fetch(pc + 1)
+        elif mode == AddressMode.EXTENDED:
+            ea = ((fetch(pc + 1) << 8) | fetch(pc + 2)) & ADDRESS_MASK
+        elif mode == AddressMode.INDEXED:
+            ea = (regs['IX'] + fetch(pc + 1)) & ADDRESS_MASK
+        elif mode == AddressMode.RELATIVE:
+            offset = fetch(pc + 1)
+            ea = (pc + inst_length + offset - ((offset & 0x80) << 1)) & ADDRESS_MASK
+        else:
+            ea = None
+
+        regs['PC'] = (pc + inst_length) & ADDRESS_MASK
+        handler(self, inst_operand, ea)
+        self.counts[pc] += 1
+        self.cycles += cycles
+        return cycles
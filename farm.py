@@ -0,0 +1,144 @@
+'''Multi-process M6800 emulation farm sharing one ROM image between workers'''
+import multiprocessing
+from multiprocessing import shared_memory
+
+from .emulator import M6800Emulator, EmulationError
+from .memory import PagedMemory, MEMORY_SIZE, ROM_PAGE
+from .peripherals import attach_williams_io
+
+# Per worker process state, set up once by _attach
+_WORKER = {}
+
+
+def _boot(image, boot_cycles):
+    '''Boot an emulator and return its state with only the pages below the ROM.'''
+    emulator = M6800Emulator(image)
+    io = attach_williams_io(emulator)
+    io.scheduler.run(emulator, boot_cycles)
+    snapshot = emulator.snapshot()
+    ram = tuple(bytes(page) for page in snapshot.pages[:ROM_PAGE])
+    return snapshot._replace(pages=ram), io.snapshot()
+
+
+def _attach(name, boot):
+    '''Pool initializer: map the shared ROM image and load the booted state to fork jobs from.'''
+    # pool workers share the parent's resource tracker, so attaching does not take ownership
+    shared = shared_memory.SharedMemory(name=name)
+    emulator = M6800Emulator(memory=PagedMemory.from_buffer(shared.buf))
+    io = attach_williams_io(emulator)
+
+    snapshot, io_state = boot
+    pages = tuple(bytearray(page) for page in snapshot.pages) + \
+        tuple(emulator.memory.pages[ROM_PAGE:])
+    emulator.restore(snapshot._replace(pages=pages))
+    io.restore(io_state)
+
+    _WORKER['shared'] = shared
+    _WORKER['emulator'] = emulator
+    _WORKER['io'] = io
+    _WORKER['boot'] = (emulator.snapshot(), io.snapshot())
+
+
+def run_script(emulator, io, script):
+    '''Run an input script on an emulator with the Williams I/O attached, return its reads.
+
+    A script is a sequence of steps:
+        ('run', cycles)                     run that many cycles, interrupts included
+        ('switch', column, row, closed)     open or close a switch of the matrix
+        ('write', address, value)           poke a byte
+        ('read', address, length)           record length bytes of memory
+        ('nmi',)                            latch a non-maskable interrupt
+    '''
+    reads = []
+    for step in script:
+        command, arguments = step[0], step[1:]
+        if command == 'run':
+            io.scheduler.run(emulator, arguments[0])
+        elif command == 'switch':
+            io.switches.set_switch(*arguments)
+        elif command == 'write':
+            emulator.write(*arguments)
+        elif command == 'read':
+            addr, length = arguments
+            reads.append(bytes(emulator.read(addr + offset) for offset in range(length)))
+        elif command == 'nmi':
+            emulator.nmi()
+        else:
+            raise ValueError(f'Unknown script command {command!r}')
+    return reads
+
+
+def _run_job(job):
+    '''Pool task: fork the booted emulator and run one script.'''
+    index, script = job
+    emulator, io = _WORKER['emulator'], _WORKER['io']
+    boot, io_boot = _WORKER['boot']
+    emulator.restore(boot)
+    io.restore(io_boot)
+
+    result = {'job': index, 'reads': [], 'error': None}
+    try:
+        result['reads'] = run_script(emulator, io, script)
+    except (EmulationError, ValueError) as error:
+        result['error'] = error.__str__()
+    result['pc'] = emulator.regs['PC']
+    result['cycles'] = emulator.cycles
+    return result
+
+
+class EmulationFarm:
+    '''Pool of emulator processes sharing a single copy of the ROM image.
+
+    The image is placed in shared memory once and every worker maps its ROM pages read-only
+    instead of receiving a copy. The parent boots once with the Williams I/O attached and
+    sends the workers the registers, devices and RAM pages. Every worker restores that state
+    before each job, so jobs only pay for the pages they write.
+
+    Leaving the with block on an exception, or before run has been iterated to the end,
+    terminates the workers instead of waiting for the queued scripts.
+
+        with EmulationFarm(image, boot_cycles=2000000) as farm:
+            for batch in farm.run(scripts):
+                ...
+    '''
+
+    def __init__(self, image, processes=None, boot_cycles=0):
+        image = bytes(image[:MEMORY_SIZE])
+        boot = _boot(image, boot_cycles)
+        self.shared = shared_memory.SharedMemory(create=True, size=MEMORY_SIZE)
+        self.shared.buf[:len(image)] = image
+        self.pool = multiprocessing.Pool(
+            processes, initializer=_attach, initargs=(self.shared.name, boot))
+        self.running = False
+
+    def run(self, scripts, batch_size=64, chunksize=16):
+        '''Run every script and yield the results in batches as soon as they complete.
+
+        Results arrive out of order, the 'job' key holds the index of the script.
+        '''
+        self.running = True
+        batch = []
+        for result in self.pool.imap_unordered(_run_job, enumerate(scripts), chunksize):
+            batch.append(result)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        self.running = False
+
+    def close(self, wait=True):
+        '''Shut the workers down, waiting for queued scripts only if wait is set.'''
+        if wait:
+            self.pool.close()
+        else:
+            self.pool.terminate()
+        self.pool.join()
+        self.shared.close()
+        self.shared.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        self.close(wait=exc_type is None and not self.running)
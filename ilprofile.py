@@ -0,0 +1,136 @@
+'''Per-opcode LLIL cost profile of the M6800 lifter, checked against a baseline'''
+import argparse
+import json
+import os
+import sys
+
+from binaryninja import Architecture
+
+from .architecture import M6800
+from .instructions import AddressMode, INSTRUCTIONS
+from .layout import ROM_START
+
+# Checked-in costs to compare against
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'il_baseline.json')
+
+# Operand bytes following the opcode while profiling, chosen so relative branches land
+# forwards, inside the ROM and away from the fall through address
+OPERAND_BYTES = b'\x10\x20\x30'
+
+# Columns of the report, in order
+COST_FIELDS = ['expressions', 'instructions', 'labels', 'flag_writes', 'flags_written']
+
+
+class RecordingLowLevelILFunction:
+    '''Stand-in for LowLevelILFunction that counts what the lifter builds.
+
+    Every expression builder call returns a new expression index. Label lookups always miss,
+    which is the most expensive path through the branch handlers.
+    '''
+
+    def __init__(self, arch, current_address=0):
+        self.arch = arch
+        self.current_address = current_address
+        self.costs = dict.fromkeys(COST_FIELDS, 0)
+        self.operations = []
+
+    def get_label_for_address(self, unused_arch, unused_addr):
+        return None
+
+    def append(self, unused_expr):
+        self.costs['instructions'] += 1
+
+    def mark_label(self, unused_label):
+        self.costs['labels'] += 1
+
+    def __getattr__(self, operation):
+        if operation.startswith('__'):
+            raise AttributeError(operation)
+
+        def build(*unused_args, flags=None, **unused_kwargs):
+            self.costs['expressions'] += 1
+            self.operations.append(operation)
+            if flags:
+                self.costs['flag_writes'] += 1
+                self.costs['flags_written'] += len(
+                    M6800.flags_written_by_flag_write_type.get(flags, []))
+            return len(self.operations) - 1
+
+        return build
+
+
+def profile(arch=None):
+    '''Lift every opcode once and return {opcode: costs}.'''
+    arch = Architecture[M6800.name] if arch is None else arch
+    result = {}
+    for opcode in sorted(INSTRUCTIONS):
+        il = RecordingLowLevelILFunction(arch, ROM_START)
+        M6800.get_instruction_low_level_il(arch, bytes([opcode]) + OPERAND_BYTES, ROM_START, il)
+        result[opcode] = il.costs
+    return result
+
+
+def report(costs, baseline=None):
+    '''Render the profile as a table, with the change from baseline when given.'''
+    lines = ['opcode  mnemonic  mode          ' + '  '.join(f'{field:>13}' for field in COST_FIELDS)]
+    totals = dict.fromkeys(COST_FIELDS, 0)
+    for opcode, cost in sorted(costs.items()):
+        nmemonic, _, inst_operand, _, mode = INSTRUCTIONS[opcode]
+        name = nmemonic
+        if inst_operand in ['ACCA', 'ACCB'] and mode != AddressMode.IMPLIED:
+            name += inst_operand[-1]
+        cells = []
+        for field in COST_FIELDS:
+            totals[field] += cost[field]
+            change = ''
+            if baseline is not None and opcode in baseline:
+                delta = cost[field] - baseline[opcode][field]
+                change = f' ({delta:+d})' if delta else ''
+            cells.append(f'{str(cost[field]) + change:>13}')
+        lines.append(f'0x{opcode:02X}    {name:<8}  {mode.name:<12}  ' + '  '.join(cells))
+    lines.append(f'{"total":<30}' + '  '.join(f'{totals[field]:>13}' for field in COST_FIELDS))
+    return '\n'.join(lines)
+
+
+def regressions(costs, baseline):
+    '''Return the opcodes whose cost grew in any field compared to the baseline.'''
+    return sorted(opcode for opcode, cost in costs.items()
+                  if opcode in baseline and
+                  any(cost[field] > baseline[opcode][field] for field in COST_FIELDS))
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path, encoding='utf8') as baseline_file:
+        return {int(opcode, 16): cost for opcode, cost in json.load(baseline_file).items()}
+
+
+def save_baseline(costs, path=BASELINE_PATH):
+    with open(path, 'w', encoding='utf8') as baseline_file:
+        json.dump({f'0x{opcode:02X}': cost for opcode, cost in sorted(costs.items())},
+                  baseline_file, indent=1)
+        baseline_file.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile the LLIL cost of every M6800 opcode')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='path to the baseline json')
+    parser.add_argument('--update', action='store_true', help='overwrite the baseline')
+    args = parser.parse_args()
+
+    costs = profile()
+    if args.update:
+        save_baseline(costs, args.baseline)
+        print(report(costs))
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    print(report(costs, baseline))
+    grown = regressions(costs, baseline)
+    if grown:
+        print('IL cost grew for ' + ', '.join(f'0x{opcode:02X}' for opcode in grown))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+'''OS routines that take parameter bytes placed directly after the call instruction'''
+import json
+from types import MappingProxyType
+
+from binaryninja import Settings, log_error
+
+from .instructions import AddressMode, ADDRESS_MASK
+
+# JSON object mapping callee addresses, or "SWI", to their parameter byte counts. The
+# architecture decodes every open view with one table, so the setting is global only
+SETTING = 'm6800.inlineArguments'
+
+# Table key for the software interrupt
+SWI = 'SWI'
+
+# The architecture is only handed a few bytes past the opcode
+MAX_INLINE_ARGUMENTS = 12
+
+# Callee address, or SWI, to the number of parameter bytes following the call. The table is
+# replaced as a whole, never modified, so analysis threads always see a consistent one
+INLINE_ARGUMENTS = MappingProxyType({})
+
+
+def inline_argument_length(nmemonic, mode, value):
+    '''Number of parameter bytes following a decoded instruction.'''
+    if nmemonic == 'SWI':
+        return INLINE_ARGUMENTS.get(SWI, 0)
+    if nmemonic in ['JSR', 'BSR'] and mode != AddressMode.INDEXED:
+        return INLINE_ARGUMENTS.get(value, 0)
+    return 0
+
+
+def parse_inline_arguments(text):
+    '''Parse the setting, such as {"0x6A12": 2, "SWI": 1}, into a table.'''
+    table = {}
+    for key, length in json.loads(text or '{}').items():
+        if not isinstance(length, int) or not 0 <= length <= MAX_INLINE_ARGUMENTS:
+            raise ValueError(f'{key}: argument length must be 0 to {MAX_INLINE_ARGUMENTS}')
+        table[SWI if key.upper() == SWI else int(key, 0) & ADDRESS_MASK] = length
+    return table
+
+
+def set_inline_arguments(table):
+    global INLINE_ARGUMENTS  # pylint: disable=global-statement
+    INLINE_ARGUMENTS = MappingProxyType(dict(table))
+
+
+def register_settings():
+    settings = Settings()
+    settings.register_group('m6800', 'M6800')
+    settings.register_setting(SETTING, json.dumps({
+        'title': 'Inline Argument Callees',
+        'type': 'string',
+        'default': '{}',
+        'description': 'JSON object of callee addresses, or "SWI", to the number of '
+                       'parameter bytes placed after the call, e.g. {"0x6A12": 2, "SWI": 1}. '
+                       'Applies to every open M6800 view, reopen them after changing it.',
+        'ignore': ['SettingsProjectScope', 'SettingsResourceScope']
+    }))
+
+
+def load_settings():
+    '''Install the configured table, keeping the current one if it is malformed.'''
+    try:
+        set_inline_arguments(parse_inline_arguments(Settings().get_string(SETTING)))
+    except (ValueError, AttributeError) as error:
+        log_error(f'Ignoring {SETTING}: {error}')
@@ -1,12 +1,16 @@
 '''File containing all instructions for the M6800 assembly language.'''
 
 from enum import IntEnum
+from types import MappingProxyType
 
 from binaryninja import LowLevelILFlagCondition
 
 # USE THIS VARIABLE TO SET YOUR MAX ADDRESS SPACE
 ADDRESS_MASK = 0x7FFF
 
+# Longest instruction in bytes
+MAX_INSTRUCTION_LENGTH = 3
+
 
 class AddressMode(IntEnum):
     '''All of the various addressing modes for the M6800'''
@@ -29,7 +33,9 @@ class InstructionType(IntEnum):
     DUAL = 5                    # instructions that have dual operands
 
 
-INSTRUCTIONS = {
+# Binary Ninja calls the architecture from several analysis threads at once, so every table
+# shared by the callbacks is read-only and needs no lock
+INSTRUCTIONS = MappingProxyType({
     # Opcode: (mnemonic, length, operand, instruction type, address mode)
     0x01: ('NOP', 1, None, InstructionType.NOP, AddressMode.IMPLIED),
     0x06: ('TAP', 1, 'Flags', None, AddressMode.IMPLIED),
@@ -133,7 +139,7 @@ INSTRUCTIONS = {
     0x8B: ('ADD', 2, 'ACCA', InstructionType.DUAL, AddressMode.IMMEDIATE),
     0x8C: ('CPX', 3, None, None, AddressMode.IMMEDIATE),
     0x8D: ('BSR', 2, None, InstructionType.CALL, AddressMode.RELATIVE),
-    0x8E: ('LDS', 2, None, None, AddressMode.IMMEDIATE),
+    0x8E: ('LDS', 3, None, None, AddressMode.IMMEDIATE),
     0x90: ('SUB', 2, 'ACCA', InstructionType.DUAL, AddressMode.DIRECT),
     0x91: ('CMP', 2, 'ACCA', InstructionType.DUAL, AddressMode.DIRECT),
     0x92: ('SBC', 2, 'ACCA', InstructionType.DUAL, AddressMode.DIRECT),
@@ -222,23 +228,39 @@ INSTRUCTIONS = {
     0xF5: ('BIT', 3, 'ACCB', InstructionType.DUAL, AddressMode.EXTENDED),
     0xF6: ('LDA', 3, 'ACCB', InstructionType.DUAL, AddressMode.EXTENDED),
     0xF7: ('STA', 3, 'ACCB', InstructionType.DUAL, AddressMode.EXTENDED),
-    0xF8: ('ADC', 3, 'ACCB', InstructionType.DUAL, AddressMode.EXTENDED),
+    0xF8: ('EOR', 3, 'ACCB', InstructionType.DUAL, AddressMode.EXTENDED),
     0xF9: ('ADC', 3, 'ACCB', InstructionType.DUAL, AddressMode.EXTENDED),
     0xFA: ('ORA', 3, 'ACCB', InstructionType.DUAL, AddressMode.EXTENDED),
     0xFB: ('ADD', 3, 'ACCB', InstructionType.DUAL, AddressMode.EXTENDED),
     0xFE: ('LDX', 3, None, None, AddressMode.EXTENDED),
     0xFF: ('STX', 3, None, None, AddressMode.EXTENDED),
-}
+})
+
+# INSTRUCTIONS indexed by opcode, None for invalid opcodes
+OPCODE_TABLE = tuple(INSTRUCTIONS.get(opcode) for opcode in range(0x100))
 
 # These instructions operate on a word, not a byte
-BIGGER_LOADS = ['CPX', 'LDS', 'LDX']
+BIGGER_LOADS = frozenset(['CPX', 'LDS', 'LDX'])
+
+# These instructions overwrite N, Z and V without reading them
+NZV_OVERWRITES = frozenset([
+    'ABA', 'ADC', 'ADD', 'AND', 'ASL', 'ASR', 'BIT', 'CBA', 'CLR', 'CMP', 'COM', 'CPX', 'DEC',
+    'EOR', 'INC', 'LDA', 'LDS', 'LDX', 'LSR', 'NEG', 'ORA', 'ROL', 'ROR', 'SBA', 'SBC', 'STA',
+    'STS', 'STX', 'SUB', 'TAB', 'TBA', 'TST'
+])
+
+# ACCB then ACCA instruction pairs that are one 16 bit operation on D, keyed by mnemonics
+WORD_ARITHMETIC = MappingProxyType({
+    ('ADD', 'ADC'): lambda il, op_1: il.add(2, il.reg(2, 'D'), op_1, flags='NVC'),
+    ('SUB', 'SBC'): lambda il, op_1: il.sub(2, il.reg(2, 'D'), op_1, flags='NVC')
+})
 
 # These instructions have different possibilities for destinations
-REGISTER_OR_MEMORY_DESTINATIONS = [
+REGISTER_OR_MEMORY_DESTINATIONS = frozenset([
     'ASL', 'ASR', 'CLR', 'COM', 'DEC', 'INC', 'LSR', 'NEG', 'ROL', 'ROR'
-]
+])
 
-LLIL_OPERATIONS = {
+LLIL_OPERATIONS = MappingProxyType({
     'ABA': lambda il, op_1, op_2: il.set_reg(
         1,
         'ACCA',
@@ -597,4 +619,4 @@ LLIL_OPERATIONS = {
         )
     ),
     'WAI': lambda il, op_1, op_2: il.unimplemented()
-}
+})
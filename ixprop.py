@@ -0,0 +1,180 @@
+'''Constant propagation of the index register, resolving INDEXED operands to addresses'''
+import struct
+from collections import namedtuple
+
+from binaryninja import log_info
+
+from .cfg import BasicBlock, Function, decode
+from .instructions import AddressMode, InstructionType, ADDRESS_MASK
+from .layout import ROM_START, ROM_SIZE
+from .ramusage import MEMORY_WRITES, MEMORY_READ_WRITES
+
+# What is known before or after an instruction: IX and SP, each a value or None, and the
+# words stored by STX and STS as sorted (address, value) pairs
+State = namedtuple('State', ['ix', 'sp', 'memory'])
+
+UNKNOWN = State(None, None, ())
+
+# Stored words remembered at once, beyond this the oldest are forgotten
+MAX_TRACKED_WORDS = 16
+
+# Change of SP made by instructions that push or pull
+STACK_ADJUSTMENTS = {'PSH': -1, 'PUL': 1, 'DES': -1, 'INS': 1}
+
+# Instructions that overwrite memory at their operand
+STORES = frozenset(MEMORY_WRITES) | frozenset(MEMORY_READ_WRITES)
+
+
+def _offset(value, delta):
+    return None if value is None else (value + delta) & ADDRESS_MASK
+
+
+def _read_word(image, memory, addr):
+    '''Word at addr: a word stored earlier in the routine, or a constant in the ROM.'''
+    for stored_addr, value in memory:
+        if stored_addr == addr:
+            return value
+    if ROM_START <= addr < ROM_START + ROM_SIZE - 1:
+        return struct.unpack('>H', image[addr:addr + 2])[0] & ADDRESS_MASK
+    return None
+
+
+def _store(memory, addr, value, size):
+    '''Return memory after writing size bytes at addr, remembering value for word writes.'''
+    if addr is None:
+        return ()
+    kept = tuple((stored, old) for stored, old in memory
+                 if not addr - 1 <= stored < addr + size)
+    if value is not None and size == 2:
+        kept = tuple(sorted(kept + ((addr, value),)))[-MAX_TRACKED_WORDS:]
+    return kept
+
+
+def transfer(image, inst, state):
+    '''Return (state after inst, address its INDEXED operand resolves to or None).'''
+    ix, sp, memory = state
+    nmemonic = inst.nmemonic
+
+    ea = None
+    if inst.mode in [AddressMode.DIRECT, AddressMode.EXTENDED]:
+        ea = inst.value
+    elif inst.mode == AddressMode.INDEXED:
+        ea = _offset(ix, inst.value)
+    resolved = ea if inst.mode == AddressMode.INDEXED else None
+
+    if inst.inst_type == InstructionType.CALL or nmemonic in ['SWI', 'WAI']:
+        # the callee may change IX and any RAM but leaves the stack balanced
+        return State(None, sp, ()), resolved
+
+    if nmemonic in ['LDX', 'LDS']:
+        if inst.mode == AddressMode.IMMEDIATE:
+            value = inst.value
+        else:
+            value = None if ea is None else _read_word(image, memory, ea)
+        if nmemonic == 'LDX':
+            ix = value
+        else:
+            sp = value
+    elif nmemonic in ['STX', 'STS']:
+        memory = _store(memory, ea, ix if nmemonic == 'STX' else sp, 2)
+    elif nmemonic == 'INX':
+        ix = _offset(ix, 1)
+    elif nmemonic == 'DEX':
+        ix = _offset(ix, -1)
+    elif nmemonic == 'TSX':
+        ix = _offset(sp, 1)
+    elif nmemonic == 'TXS':
+        sp = _offset(ix, -1)
+    elif nmemonic in STACK_ADJUSTMENTS:
+        sp = _offset(sp, STACK_ADJUSTMENTS[nmemonic])
+    elif nmemonic in STORES and inst.mode != AddressMode.ACCUMULATOR:
+        memory = _store(memory, ea, None, 1)
+
+    return State(ix, sp, memory), resolved
+
+
+def meet(left, right):
+    '''Keep only what both states agree on.'''
+    return State(
+        left.ix if left.ix == right.ix else None,
+        left.sp if left.sp == right.sp else None,
+        tuple(sorted(set(left.memory) & set(right.memory)))
+    )
+
+
+class IxPropagation:
+    '''Forward dataflow of IX, SP and stored words over the blocks of each routine.
+
+    Block results are cached by block contents and entry state, so running the pass again after
+    analysis changes only revisits blocks that changed or are now entered in a different state.
+    '''
+
+    def __init__(self, image):
+        self.image = image
+        self.cache = {}
+
+    def block(self, block, state):
+        '''Return (exit state, {instruction address: resolved address}) for a block.'''
+        key = (block.start, b''.join(inst.data for inst in block.instructions), state)
+        result = self.cache.get(key)
+        if result is None:
+            resolved = {}
+            for inst in block.instructions:
+                state, target = transfer(self.image, inst, state)
+                if target is not None:
+                    resolved[inst.addr] = target
+            result = self.cache[key] = (state, resolved)
+        return result
+
+    def function(self, function, entry=UNKNOWN):
+        '''Return {instruction address: resolved address} for the INDEXED operands of function.'''
+        if function.start not in function.blocks:
+            return {}
+        entry_states = {function.start: entry}
+        pending = [function.start]
+        while pending:
+            start = pending.pop()
+            exit_state, _ = self.block(function.blocks[start], entry_states[start])
+            for successor in function.blocks[start].successors:
+                if successor not in function.blocks:
+                    continue
+                old = entry_states.get(successor)
+                new = exit_state if old is None else meet(old, exit_state)
+                if new != old:
+                    entry_states[successor] = new
+                    pending.append(successor)
+
+        resolved = {}
+        for start, state in entry_states.items():
+            resolved.update(self.block(function.blocks[start], state)[1])
+        return resolved
+
+
+def _view_function(image, function):
+    '''cfg.Function for a Binary Ninja function, keeping its basic blocks and edges.'''
+    blocks = {}
+    for basic_block in function.basic_blocks:
+        instructions, addr = [], basic_block.start
+        while addr < basic_block.end:
+            inst = decode(image, addr)
+            if inst is None:
+                break
+            instructions.append(inst)
+            addr += inst.length
+        blocks[basic_block.start] = BasicBlock(
+            basic_block.start, basic_block.end, tuple(instructions),
+            tuple(edge.target.start for edge in basic_block.outgoing_edges))
+    return Function(function.start, blocks, set(), set())
+
+
+def add_indexed_references(view):
+    '''PluginCommand callback adding a reference from every resolvable INDEXED operand.'''
+    raw = view.parent_view
+    image = raw.read(0, raw.length)[:ADDRESS_MASK + 1].ljust(ADDRESS_MASK + 1, b'\x00')
+    propagation = IxPropagation(image)
+    count = 0
+    for function in view.functions:
+        for addr, target in propagation.function(_view_function(image, function)).items():
+            function.add_user_code_ref(addr, target)
+            count += 1
+    log_info(f'Resolved {count} indexed operands')
@@ -0,0 +1,12 @@
+'''Memory layout of the pinball boards, shared by the BinaryView and the analysis tools'''
+from .instructions import ADDRESS_MASK
+
+RAM_START, RAM_SIZE = 0x0, 0x200
+PROGRAM_MEMORY_START, PROGRAM_MEMORY_SIZE = 0x0, 0x100
+CMOS_MEMORY_START, CMOS_MEMORY_SIZE = 0x100, 0x100
+ROM_START, ROM_SIZE = 0x5800, 0x2800
+GAME_OS_START, GAME_OS_SIZE = 0x5800, 0x1000
+FLIPPER_OS_START, FLIPPER_OS_SIZE = 0x6800, 0x1800
+
+# IRQ, SWI, NMI and reset vectors
+VECTORS_START, VECTORS_SIZE = 0xFFF8 & ADDRESS_MASK, 8
@@ -0,0 +1,147 @@
+'''Paged copy-on-write memory for the M6800 emulator'''
+from .instructions import ADDRESS_MASK
+from .layout import ROM_START
+
+# Size of the emulated address space
+MEMORY_SIZE = ADDRESS_MASK + 1
+
+# 256 byte pages, the same granularity as the M6800 direct page
+PAGE_SHIFT = 8
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_SIZE - 1
+PAGE_COUNT = MEMORY_SIZE >> PAGE_SHIFT
+
+# Pages from here on hold the ROM and ignore writes
+ROM_PAGE = ROM_START >> PAGE_SHIFT
+
+
+class IOPage:
+    '''Address decoder for one page holding memory mapped device registers.
+
+    Addresses without a device fall through to the underlying memory page.
+    '''
+
+    def __init__(self, memory, index):
+        self.memory = memory
+        self.index = index
+        self.decode = [None] * PAGE_SIZE
+
+    def read(self, addr):
+        entry = self.decode[addr & PAGE_MASK]
+        if entry is None:
+            return self.memory.pages[self.index][addr & PAGE_MASK]
+        device, register = entry
+        return device.read(register)
+
+    def write(self, addr, value):
+        entry = self.decode[addr & PAGE_MASK]
+        if entry is None:
+            self.memory.store(addr, value)
+        else:
+            device, register = entry
+            device.write(register, value)
+
+
+class PagedMemory:
+    '''The emulated address space as a table of pages shared with snapshots.
+
+    A page may only be written in place while its generation matches the memory's current
+    generation. Taking a snapshot bumps the generation, so the next write to any page copies
+    it first and the snapshot keeps the original.
+
+    Pages with a handler, such as an IOPage, route every access through it instead.
+    '''
+
+    def __init__(self, image=b''):
+        image = bytes(image[:MEMORY_SIZE]).ljust(MEMORY_SIZE, b'\x00')
+        self.pages = [bytearray(image[index << PAGE_SHIFT:(index + 1) << PAGE_SHIFT])
+                      for index in range(PAGE_COUNT)]
+        self.generations = [0] * PAGE_COUNT
+        self.generation = 0
+        self.handlers = [None] * PAGE_COUNT
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        '''Build memory whose ROM pages are read-only views of buffer, without copying them.
+
+        Only the writable pages below the ROM get private copies.
+        '''
+        view = memoryview(buffer).toreadonly()
+        memory = cls(view[:ROM_PAGE << PAGE_SHIFT])
+        for index in range(ROM_PAGE, PAGE_COUNT):
+            memory.pages[index] = view[index << PAGE_SHIFT:(index + 1) << PAGE_SHIFT]
+        return memory
+
+    def map_device(self, start, length, device):
+        '''Decode [start, start + length) to device registers 0 to length - 1.'''
+        for offset in range(length):
+            addr = (start + offset) & ADDRESS_MASK
+            index = addr >> PAGE_SHIFT
+            if not isinstance(self.handlers[index], IOPage):
+                self.handlers[index] = IOPage(self, index)
+            self.handlers[index].decode[addr & PAGE_MASK] = (device, offset)
+
+    def read(self, addr):
+        addr &= ADDRESS_MASK
+        index = addr >> PAGE_SHIFT
+        handler = self.handlers[index]
+        if handler is not None:
+            return handler.read(addr)
+        return self.pages[index][addr & PAGE_MASK]
+
+    def fetch(self, addr):
+        '''Read an instruction byte from the page data, bypassing any handler.
+
+        Page handlers see data accesses only, so a watchpoint never fires on a fetch.
+        '''
+        addr &= ADDRESS_MASK
+        return self.pages[addr >> PAGE_SHIFT][addr & PAGE_MASK]
+
+    def write(self, addr, value):
+        addr &= ADDRESS_MASK
+        handler = self.handlers[addr >> PAGE_SHIFT]
+        if handler is not None:
+            handler.write(addr, value)
+        else:
+            self.store(addr, value)
+
+    def store(self, addr, value):
+        '''Write a byte to the page data, bypassing any handler.'''
+        index = addr >> PAGE_SHIFT
+
+        # the ROM ignores writes
+        if index >= ROM_PAGE:
+            return
+
+        if self.generations[index] != self.generation:
+            self.pages[index] = bytearray(self.pages[index])
+            self.generations[index] = self.generation
+        self.pages[index][addr & PAGE_MASK] = value
+
+    def snapshot(self):
+        '''Freeze the current pages and return them.
+
+        Only the page table is copied, no page data, so the cost does not depend on how much
+        memory the program has touched.
+        '''
+        self.generation += 1
+        return tuple(self.pages)
+
+    def restore(self, pages):
+        '''Go back to a snapshot, only replacing the pages that changed since it was taken.
+
+        Returns the number of pages replaced.
+        '''
+        replaced = 0
+        current = self.pages
+        for index, page in enumerate(pages):
+            if current[index] is not page:
+                current[index] = page
+                # the page belongs to the snapshot, copy it before writing again
+                self.generations[index] = -1
+                replaced += 1
+        return replaced
+
+    def dump(self):
+        '''Return the whole address space as bytes.'''
+        return b''.join(self.pages)
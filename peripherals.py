@@ -0,0 +1,252 @@
+'''Event driven peripheral stand-ins for the M6800 emulator'''
+import heapq
+from itertools import count
+
+# PIA base addresses on the Williams boards, each PIA decodes four registers
+PIA_ADDRESSES = {
+    'sound': 0x2100,
+    'solenoids': 0x2200,
+    'lamps': 0x2400,
+    'display': 0x2800,
+    'switches': 0x3000,
+}
+PIA_REGISTERS = 4
+
+# The periodic IRQ fires about once a millisecond at the 0.895 MHz CPU clock
+IRQ_PERIOD = 896
+
+# 6821 control register bits
+CONTROL_IRQ1_ENABLE = 0x01
+CONTROL_DATA_SELECT = 0x04
+CONTROL_C2_OUTPUT = 0x30
+CONTROL_C2_LEVEL = 0x08
+CONTROL_IRQ1_FLAG = 0x80
+CONTROL_FLAGS = 0xC0
+
+
+class Scheduler:
+    '''Heap of callbacks keyed on the emulated cycle they fall due.
+
+    The emulator runs flat out until the earliest event, so devices cost nothing between
+    their events instead of being polled on every instruction.
+    '''
+
+    def __init__(self):
+        self.events = []
+        # events due on the same cycle fire in the order they were scheduled
+        self.sequence = count()
+
+    def schedule(self, cycle, callback):
+        '''Call callback(cycle) once the emulator reaches cycle.'''
+        heapq.heappush(self.events, (cycle, next(self.sequence), callback))
+
+    def run(self, emulator, cycles):
+        '''Run the emulator for at least the given number of cycles, firing due events.'''
+        target = emulator.cycles + cycles
+        events = self.events
+        step = emulator.step
+        while emulator.cycles < target:
+            deadline = min(target, events[0][0]) if events else target
+            while emulator.cycles < deadline:
+                step()
+            while events and events[0][0] <= emulator.cycles:
+                due, _, callback = heapq.heappop(events)
+                callback(due)
+        return emulator.cycles
+
+
+class InterruptLine:
+    '''Wired-OR IRQ line, asserted while any source holds it.
+
+    Level sources hold the line until they release it, pulsed sources until the CPU takes
+    the interrupt.
+    '''
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.levels = set()
+        self.pulses = set()
+        emulator.acknowledge = self.acknowledge
+
+    def set(self, source, asserted):
+        if asserted:
+            self.levels.add(source)
+        else:
+            self.levels.discard(source)
+        self._drive()
+
+    def pulse(self, source):
+        self.pulses.add(source)
+        self._drive()
+
+    def acknowledge(self):
+        self.pulses.clear()
+        self._drive()
+
+    def _drive(self):
+        self.emulator.irq(bool(self.levels or self.pulses))
+
+
+class PeriodicIRQ:
+    '''Timer pulsing the IRQ line every period cycles.'''
+
+    def __init__(self, scheduler, line, period=IRQ_PERIOD, start=0):
+        self.scheduler = scheduler
+        self.line = line
+        self.period = period
+        self.due = None
+        self.start(start + period)
+
+    def start(self, cycle):
+        '''Fire next at cycle.'''
+        self.due = cycle
+        self.scheduler.schedule(cycle, self._fire)
+
+    def _fire(self, cycle):
+        self.line.pulse(self)
+        # reschedule from the due cycle so instruction overshoot does not drift the timer
+        self.start(cycle + self.period)
+
+
+class PIA6821:
+    '''Register level stand-in for a 6821 peripheral interface adapter.
+
+    Registers: 0 port A data or direction, 1 control A, 2 port B data or direction,
+    3 control B. Input pins are set with set_input, output changes are reported through
+    on_output(pia, port, value), where ports 2 and 3 are the CA2 and CB2 output lines.
+    '''
+
+    def __init__(self, name, line=None, on_output=None):
+        self.name = name
+        self.line = line
+        self.on_output = on_output
+        self.data = [0, 0]
+        self.direction = [0, 0]
+        self.control = [0, 0]
+        self.inputs = [0, 0]
+
+    def read(self, register):
+        port = register >> 1
+        if register & 1:
+            return self.control[port]
+        if not self.control[port] & CONTROL_DATA_SELECT:
+            return self.direction[port]
+
+        # reading the data register clears the interrupt flags
+        self.control[port] &= ~CONTROL_FLAGS
+        self._update_irq()
+        direction = self.direction[port]
+        return (self.data[port] & direction) | (self.inputs[port] & ~direction & 0xFF)
+
+    def write(self, register, value):
+        port = register >> 1
+        if register & 1:
+            self.control[port] = (self.control[port] & CONTROL_FLAGS) | (value & ~CONTROL_FLAGS)
+            self._update_irq()
+            if value & CONTROL_C2_OUTPUT == CONTROL_C2_OUTPUT and self.on_output is not None:
+                self.on_output(self, port + 2, 1 if value & CONTROL_C2_LEVEL else 0)
+        elif not self.control[port] & CONTROL_DATA_SELECT:
+            self.direction[port] = value
+        else:
+            self.data[port] = value
+            if self.on_output is not None:
+                self.on_output(self, port, value & self.direction[port])
+
+    def set_input(self, port, value):
+        self.inputs[port] = value
+
+    def snapshot(self):
+        return tuple(tuple(registers) for registers in [self.data, self.direction,
+                                                        self.control, self.inputs])
+
+    def restore(self, state):
+        self.data, self.direction, self.control, self.inputs = (list(registers)
+                                                                for registers in state)
+        self._update_irq()
+
+    def pulse_c1(self, port):
+        '''Active transition on CA1 or CB1.'''
+        self.control[port] |= CONTROL_IRQ1_FLAG
+        self._update_irq()
+
+    def _update_irq(self):
+        if self.line is not None:
+            self.line.set(self, any(control & CONTROL_IRQ1_FLAG and control & CONTROL_IRQ1_ENABLE
+                                    for control in self.control))
+
+
+class SwitchMatrix:
+    '''Switch matrix behind the switch PIA: port B strobes columns, port A returns rows.'''
+
+    def __init__(self, pia):
+        self.pia = pia
+        self.closed = [0] * 8
+        self.strobe = 0
+        pia.on_output = self._strobe
+
+    def set_switch(self, column, row, closed=True):
+        if closed:
+            self.closed[column] |= 1 << row
+        else:
+            self.closed[column] &= ~(1 << row)
+        self._update()
+
+    def snapshot(self):
+        return tuple(self.closed), self.strobe
+
+    def restore(self, state):
+        closed, self.strobe = state
+        self.closed = list(closed)
+        self._update()
+
+    def _strobe(self, _, port, value):
+        if port == 1:
+            self.strobe = value
+            self._update()
+
+    def _update(self):
+        rows = 0
+        for column in range(8):
+            if self.strobe & (1 << column):
+                rows |= self.closed[column]
+        self.pia.set_input(0, rows)
+
+
+class WilliamsIO:
+    '''The Williams PIAs mapped into an emulator, with the periodic IRQ and its scheduler.
+
+    Run the emulator with scheduler.run so the IRQ handler, where the OS scans the switches
+    and drives the lamps and displays, gets to run.
+    '''
+
+    def __init__(self, emulator, on_output=None, period=IRQ_PERIOD):
+        self.scheduler = Scheduler()
+        self.line = InterruptLine(emulator)
+        self.pias = {}
+        for name, base in PIA_ADDRESSES.items():
+            self.pias[name] = PIA6821(name, self.line, on_output)
+            emulator.memory.map_device(base, PIA_REGISTERS, self.pias[name])
+        self.switches = SwitchMatrix(self.pias['switches'])
+        self.timer = PeriodicIRQ(self.scheduler, self.line, period, emulator.cycles)
+
+    def snapshot(self):
+        '''Device and timer state as plain values, so it can be sent to another process.'''
+        return ({name: pia.snapshot() for name, pia in self.pias.items()},
+                self.switches.snapshot(), self.timer.due, self.timer in self.line.pulses)
+
+    def restore(self, state):
+        '''Return to a snapshot taken from this or an identically built WilliamsIO.'''
+        pias, switches, due, pulsed = state
+        self.scheduler.events.clear()
+        self.timer.start(due)
+        self.line.pulses = {self.timer} if pulsed else set()
+        # restoring the PIAs recomputes their IRQ outputs and drives the line
+        self.line.levels.clear()
+        for name, pia in self.pias.items():
+            pia.restore(pias[name])
+        self.switches.restore(switches)
+
+
+def attach_williams_io(emulator, on_output=None, period=IRQ_PERIOD):
+    '''Map the Williams PIAs into the emulator and start the periodic IRQ.'''
+    return WilliamsIO(emulator, on_output, period)
@@ -0,0 +1,132 @@
+'''Cycle accounting profiler for emulated execution, written as collapsed flame graph stacks'''
+import argparse
+import sys
+
+from .cfg import load_image
+from .emulator import M6800Emulator, EmulationError, EmulatorWrapper
+from .instructions import InstructionType, INSTRUCTIONS
+from .peripherals import attach_williams_io
+
+# Distinct call stacks kept, cycles of new stacks beyond this go to their deepest kept caller
+MAX_STACKS = 1 << 16
+
+# Frames beyond this depth are not pushed, runaway recursion stays at one stack
+MAX_DEPTH = 64
+
+# Stack charged when no caller of a new stack is kept
+OVERFLOW = ('[other]',)
+
+# Opcodes entering a routine: calls and the software interrupt
+ENTRIES = frozenset(opcode for opcode, (nmemonic, _, _, inst_type, _) in INSTRUCTIONS.items()
+                    if inst_type == InstructionType.CALL or nmemonic == 'SWI')
+
+# Opcodes that may leave routines: returns, and stack pointer loads that discard frames
+EXITS = frozenset(opcode for opcode, (nmemonic, _, _, inst_type, _) in INSTRUCTIONS.items()
+                  if inst_type == InstructionType.RETURN or nmemonic in ['RTI', 'LDS', 'TXS'])
+
+# SP of the frame at the root of the shadow stack, above any real stack
+ROOT_SP = 0x10000
+
+
+class CycleProfiler(EmulatorWrapper):
+    '''Wraps an emulator, keeping a shadow call stack and charging every cycle to it.
+
+    Calls, SWI and interrupts push a frame holding the SP inside the routine. Returns and
+    stack pointer loads pop every frame whose SP is below the real one, so the shadow stack
+    resynchronises after routines that discard their return address instead of returning.
+
+    Stacks are interned tuples of entry addresses and at most max_stacks of them are counted,
+    so memory stays fixed however long the emulation runs.
+    '''
+
+    def __init__(self, emulator, max_stacks=MAX_STACKS, max_depth=MAX_DEPTH):
+        super().__init__(emulator)
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.samples = {}
+        self.frames = [(emulator.regs['PC'], ROOT_SP)]
+        self._charge_to()
+
+    def _charge_to(self):
+        '''Pick the sample the current stack is charged to, after every push or pop.'''
+        stack = tuple(addr for addr, _ in self.frames)
+        samples = self.samples
+        while stack and stack not in samples and len(samples) >= self.max_stacks:
+            stack = stack[:-1]
+        if not stack:
+            stack = OVERFLOW
+        self.stack = stack
+        samples.setdefault(stack, 0)
+
+    def _push(self, addr, sp):
+        if len(self.frames) < self.max_depth:
+            self.frames.append((addr, sp))
+            self._charge_to()
+
+    def _unwind(self, sp):
+        frames = self.frames
+        if len(frames) > 1 and frames[-1][1] < sp:
+            while len(frames) > 1 and frames[-1][1] < sp:
+                frames.pop()
+            self._charge_to()
+
+    def step(self):
+        '''Step the emulator once, charging its cycles to the current stack.'''
+        emulator = self.emulator
+        regs = emulator.regs
+        pc = regs['PC']
+        executed = emulator.counts[pc]
+        opcode = emulator.fetch(pc)
+
+        cycles = emulator.step()
+        self.samples[self.stack] += cycles
+
+        if emulator.counts[pc] == executed:
+            # nothing executed, so unless the CPU is still waiting an interrupt was entered
+            if regs['PC'] != pc:
+                self._push(regs['PC'], regs['SP'])
+        elif opcode in ENTRIES:
+            self._push(regs['PC'], regs['SP'])
+        elif opcode in EXITS:
+            self._unwind(regs['SP'])
+        return cycles
+
+    def collapsed(self, names=None):
+        '''Lines of "caller;callee cycles", the input format of flamegraph.pl and speedscope.'''
+        names = names or {}
+        lines = []
+        for stack, cycles in sorted(self.samples.items(), key=lambda sample: -sample[1]):
+            if not cycles:
+                continue
+            frames = [frame if isinstance(frame, str) else names.get(frame, f'sub_{frame:x}')
+                      for frame in stack]
+            lines.append(f'{";".join(frames)} {cycles}')
+        return lines
+
+    def write_collapsed(self, path, names=None):
+        with open(path, 'w', encoding='utf8') as output:
+            for line in self.collapsed(names):
+                output.write(line + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile an emulated M6800 ROM by call stack')
+    parser.add_argument('rom', help='flat ROM image laid out by address')
+    parser.add_argument('output', help='collapsed stack file to write')
+    parser.add_argument('--cycles', type=int, default=10_000_000, help='cycles to emulate')
+    parser.add_argument('--max-stacks', type=int, default=MAX_STACKS)
+    args = parser.parse_args()
+
+    emulator = M6800Emulator(load_image(args.rom))
+    io = attach_williams_io(emulator)
+    profiler = CycleProfiler(emulator, args.max_stacks)
+    try:
+        io.scheduler.run(profiler, args.cycles)
+    except EmulationError as error:
+        print(error, file=sys.stderr)
+    profiler.write_collapsed(args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+'''RAM and CMOS variable usage map for the Motorola M6800 BinaryView'''
+from binaryninja import log_error
+
+from .architecture import M6800
+from .inlineargs import inline_argument_length
+from .instructions import AddressMode, InstructionType, BIGGER_LOADS, MAX_INSTRUCTION_LENGTH
+from .layout import (RAM_START, RAM_SIZE, PROGRAM_MEMORY_START, PROGRAM_MEMORY_SIZE,
+                     CMOS_MEMORY_START, CMOS_MEMORY_SIZE)
+
+# These instructions only write their memory operand
+MEMORY_WRITES = ['CLR', 'STA', 'STS', 'STX']
+
+# These instructions read and write back their memory operand
+MEMORY_READ_WRITES = ['ASL', 'ASR', 'COM', 'DEC', 'INC', 'LSR', 'NEG', 'ROL', 'ROR']
+
+# These instructions touch a word, not a byte
+WORD_ACCESSES = BIGGER_LOADS | {'STS', 'STX'}
+
+# Characters used by the heat map, coolest first
+HEAT_SCALE = ' .:-=+*#%@'
+
+
+def _access_mask(addr, size):
+    '''Bitmap with one bit set per RAM byte covered by the access.'''
+    mask = 0
+    for byte in range(addr, addr + size):
+        if RAM_START <= byte < RAM_START + RAM_SIZE:
+            mask |= 1 << (byte - RAM_START)
+    return mask
+
+
+def block_usage(read, start, end):
+    '''Return the (read, write) RAM bitmaps of the instructions in [start, end).
+
+    read is a callable taking (address, length) and returning bytes, such as BinaryView.read.
+
+    Only DIRECT and EXTENDED operands have a known address, INDEXED operands are skipped.
+    '''
+    reads, writes = 0, 0
+    addr = start
+    while addr < end:
+        data = read(addr, MAX_INSTRUCTION_LENGTH)
+        if not data:
+            break
+        try:
+            (nmemonic, inst_length, _,
+             inst_type, mode, value) = M6800._decode_instruction(data, addr)
+        except LookupError as error:
+            log_error(error.__str__())
+            break
+        addr += inst_length + inline_argument_length(nmemonic, mode, value)
+
+        # jumps and calls use their operand as a destination, not a variable
+        if mode not in [AddressMode.DIRECT, AddressMode.EXTENDED] or inst_type in [
+                InstructionType.UNCONDITIONAL_BRANCH, InstructionType.CALL]:
+            continue
+
+        mask = _access_mask(value, 2 if nmemonic in WORD_ACCESSES else 1)
+        if not mask:
+            continue
+        if nmemonic in MEMORY_WRITES:
+            writes |= mask
+        elif nmemonic in MEMORY_READ_WRITES:
+            reads |= mask
+            writes |= mask
+        else:
+            reads |= mask
+
+    return reads, writes
+
+
+class RamUsage:
+    '''Per-function read/write bitmaps over the RAM segment.
+
+    Bit n of each bitmap stands for address RAM_START + n. The direct maps only cover the
+    function itself, the inclusive maps are OR-ed together with every function it calls.
+    '''
+
+    def __init__(self, names, direct, callees):
+        self.names = names
+        self.direct = direct
+        self.inclusive = RamUsage._aggregate(direct, callees)
+
+    @classmethod
+    def from_view(cls, view):
+        '''Build the usage map for every function in the BinaryView.'''
+        names, direct, callees = {}, {}, {}
+        for function in view.functions:
+            reads, writes = 0, 0
+            for block in function.basic_blocks:
+                block_reads, block_writes = block_usage(view.read, block.start, block.end)
+                reads |= block_reads
+                writes |= block_writes
+
+            names[function.start] = function.name
+            direct[function.start] = (reads, writes)
+            callees[function.start] = {callee.start for callee in function.callees}
+
+        return cls(names, direct, callees)
+
+    @staticmethod
+    def _aggregate(direct, callees):
+        '''OR the bitmaps up the call graph until nothing changes, which also covers recursion.'''
+        callers = {function: set() for function in direct}
+        for function, targets in callees.items():
+            for target in targets:
+                if target in callers:
+                    callers[target].add(function)
+
+        inclusive = dict(direct)
+        pending = list(direct)
+        while pending:
+            function = pending.pop()
+            reads, writes = inclusive[function]
+            for caller in callers[function]:
+                caller_reads, caller_writes = inclusive[caller]
+                merged = (caller_reads | reads, caller_writes | writes)
+                if merged != (caller_reads, caller_writes):
+                    inclusive[caller] = merged
+                    pending.append(caller)
+
+        return inclusive
+
+    def touched(self, inclusive=False):
+        '''Bitmap of every RAM byte that any function reads or writes.'''
+        usage = self.inclusive if inclusive else self.direct
+        mask = 0
+        for reads, writes in usage.values():
+            mask |= reads | writes
+        return mask
+
+    def heat(self, inclusive=False):
+        '''Number of functions touching each RAM byte.'''
+        usage = self.inclusive if inclusive else self.direct
+        counts = [0] * RAM_SIZE
+        for reads, writes in usage.values():
+            for bit in _bits(reads | writes):
+                counts[bit] += 1
+        return counts
+
+    def contention(self):
+        '''Map every RAM address written by one function and touched by another.
+
+        Only the direct maps are compared, so a caller does not contend with its own callees.
+        '''
+        result = {}
+        for bit in _bits(self.touched()):
+            mask = 1 << bit
+            writers = [function for function, (_, writes) in self.direct.items() if writes & mask]
+            users = [function for function, (reads, writes) in self.direct.items()
+                     if (reads | writes) & mask]
+            if writers and len(users) > 1:
+                result[RAM_START + bit] = (sorted(writers), sorted(users))
+        return result
+
+    def matrix(self, inclusive=False):
+        '''Render a function by address matrix over the touched addresses only.
+
+        Each cell is R (read), W (write), B (both) or . (untouched).
+        '''
+        usage = self.inclusive if inclusive else self.direct
+        columns = list(_bits(self.touched(inclusive)))
+        width = max([len(name) for name in self.names.values()] + [8])
+
+        lines = [' ' * width + ' ' + ' '.join(f'{RAM_START + bit:03X}'[i] for bit in columns)
+                 for i in range(3)]
+        for function in sorted(usage):
+            reads, writes = usage[function]
+            cells = []
+            for bit in columns:
+                read, write = (reads >> bit) & 1, (writes >> bit) & 1
+                cells.append('B' if read and write else 'W' if write else 'R' if read else '.')
+            lines.append(f'{self.names[function]:<{width}} ' + ' '.join(cells))
+        return '\n'.join(lines)
+
+    def heat_map(self, inclusive=False):
+        '''Render the RAM segment as a 16 byte wide heat map of function counts.'''
+        counts = self.heat(inclusive)
+        hottest = max(counts) or 1
+        lines = ['     ' + ''.join(f'{column:X}' for column in range(16))]
+        for row in range(0, RAM_SIZE, 16):
+            cells = ''.join(HEAT_SCALE[(count * (len(HEAT_SCALE) - 1) + hottest - 1) // hottest]
+                            for count in counts[row:row + 16])
+            lines.append(f'{RAM_START + row:03X}  {cells}')
+        return '\n'.join(lines)
+
+    def report(self):
+        '''Plain text report with the heat maps, the matrix and the contended variables.'''
+        sections = [
+            'Direct usage heat map (functions per byte)', self.heat_map(), '',
+            'Inclusive usage heat map (including callees)', self.heat_map(inclusive=True), '',
+            'Direct usage matrix', self.matrix(), '',
+            'Contended variables'
+        ]
+        for addr, (writers, users) in sorted(self.contention().items()):
+            writer_names = ', '.join(self.names[function] for function in writers)
+            user_names = ', '.join(self.names[function] for function in users)
+            sections.append(f'0x{addr:03X} {_region(addr)}: '
+                            f'written by {writer_names}; used by {user_names}')
+        return '\n'.join(sections)
+
+
+def _bits(mask):
+    '''Yield the indices of the set bits of mask in ascending order.'''
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _region(addr):
+    '''Name of the RAM section containing addr.'''
+    if PROGRAM_MEMORY_START <= addr < PROGRAM_MEMORY_START + PROGRAM_MEMORY_SIZE:
+        return 'Program Memory'
+    if CMOS_MEMORY_START <= addr < CMOS_MEMORY_START + CMOS_MEMORY_SIZE:
+        return 'CMOS Memory'
+    return 'RAM'
+
+
+def show_ram_usage(view):
+    '''PluginCommand callback showing the RAM usage report for the view.'''
+    view.show_plain_text_report('M6800 RAM Usage', RamUsage.from_view(view).report())
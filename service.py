@@ -0,0 +1,214 @@
+'''Long running disassembly service answering JSON queries over a Unix socket
+
+Every line sent to the socket is one JSON request, or a JSON list of requests answered in
+order. Every request gets one JSON response line, written as soon as it is ready:
+
+    {"id": 1, "op": "disassemble", "rom": "/roms/game.bin", "addr": 22528, "count": 16}
+    {"id": 1, "result": [[22528, "8E01FF", "LDS 0x1FF"], ...]}
+
+Operations are load, functions, disassemble, xrefs and cfg. ROMs are decoded once and kept
+in memory until their file changes.
+'''
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+from collections import defaultdict
+
+from .architecture import M6800
+from .cfg import build_cfg, decode, load_image
+from .instructions import AddressMode, ADDRESS_MASK
+
+# Default socket, one per user
+SOCKET_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'm6800-disassembly.sock')
+
+# Largest disassembly answered in one response
+MAX_COUNT = 4096
+
+# Operands that reference another address
+REFERENCE_MODES = [AddressMode.DIRECT, AddressMode.EXTENDED, AddressMode.RELATIVE]
+
+
+class RequestError(Exception):
+    pass
+
+
+class LoadedRom:
+    '''Decoded state of one ROM: its functions, cross references and rendered instructions.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self.image = load_image(path)
+        self.functions = build_cfg(self.image)
+        self.lines = {}
+
+        self.xrefs = defaultdict(set)
+        for function in self.functions.values():
+            for block in function.blocks.values():
+                for inst in block.instructions:
+                    if inst.mode in REFERENCE_MODES and inst.value is not None:
+                        self.xrefs[inst.value].add(inst.addr)
+
+    def is_stale(self):
+        try:
+            return os.stat(self.path).st_mtime_ns != self.mtime
+        except OSError:
+            return True
+
+    def line(self, addr):
+        '''Return (addr, hex bytes, text, length) for the instruction at addr.'''
+        line = self.lines.get(addr)
+        if line is None:
+            inst = decode(self.image, addr)
+            if inst is None:
+                line = (addr, f'{self.image[addr]:02X}', f'.byte 0x{self.image[addr]:02X}', 1)
+            else:
+                tokens, _ = M6800.get_instruction_text(None, inst.data, addr)
+                line = (addr, inst.data.hex().upper(), ''.join(token.text for token in tokens),
+                        inst.length)
+            self.lines[addr] = line
+        return line
+
+    def disassemble(self, addr, count):
+        result = []
+        for _ in range(count):
+            if addr > ADDRESS_MASK:
+                break
+            addr, data, text, length = self.line(addr)
+            result.append([addr, data, text])
+            addr += length
+        return result
+
+    def function_containing(self, addr):
+        for function in self.functions.values():
+            for block in function.blocks.values():
+                if block.start <= addr < block.end:
+                    return function
+        return None
+
+    def cfg(self, addr):
+        function = self.functions.get(addr) or self.function_containing(addr)
+        if function is None:
+            raise RequestError(f'no function at 0x{addr:04X}')
+        return {
+            'start': function.start,
+            'blocks': [[block.start, block.end, list(block.successors)]
+                       for _, block in sorted(function.blocks.items())],
+            'callees': sorted(function.callees),
+            'callers': sorted(function.callers)
+        }
+
+
+class DisassemblyService:
+    '''Keeps loaded ROMs warm and answers requests against them.
+
+    Loading runs in the default executor so a large ROM does not stall other clients, and
+    concurrent requests for the same ROM share one load.
+    '''
+
+    def __init__(self):
+        self.roms = {}
+
+    async def rom(self, path):
+        if not isinstance(path, str):
+            raise RequestError('rom must be a path')
+        path = os.path.realpath(path)
+        pending = self.roms.get(path)
+        if pending is not None and pending.done() and (
+                pending.exception() is not None or pending.result().is_stale()):
+            pending = None
+        if pending is None:
+            pending = asyncio.get_running_loop().run_in_executor(None, LoadedRom, path)
+            self.roms[path] = pending
+        try:
+            return await asyncio.shield(pending)
+        except OSError as error:
+            raise RequestError(f'unable to load {path}: {error.strerror}') from error
+
+    async def handle(self, request):
+        op = request.get('op')
+        rom = await self.rom(request.get('rom'))
+        addr = request.get('addr', 0)
+        if not isinstance(addr, int) or not 0 <= addr <= ADDRESS_MASK:
+            raise RequestError('addr must be an address')
+
+        if op == 'load':
+            return {'functions': len(rom.functions)}
+        if op == 'functions':
+            return sorted(rom.functions)
+        if op == 'disassemble':
+            count = request.get('count', 1)
+            if not isinstance(count, int) or not 0 < count <= MAX_COUNT:
+                raise RequestError(f'count must be between 1 and {MAX_COUNT}')
+            return rom.disassemble(addr, count)
+        if op == 'xrefs':
+            return sorted(rom.xrefs.get(addr, ()))
+        if op == 'cfg':
+            return rom.cfg(addr)
+        raise RequestError(f'unknown op {op!r}')
+
+    async def respond(self, request, writer):
+        if not isinstance(request, dict):
+            response = {'id': None, 'error': 'request must be an object'}
+        else:
+            response = {'id': request.get('id')}
+            try:
+                response['result'] = await self.handle(request)
+            except RequestError as error:
+                response['error'] = str(error)
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+
+    async def client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    requests = json.loads(line)
+                except ValueError:
+                    requests = [None]
+                if not isinstance(requests, list):
+                    requests = [requests]
+                for request in requests:
+                    await self.respond(request, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path=SOCKET_PATH):
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.client, path, limit=1 << 20)
+        async with server:
+            await server.serve_forever()
+
+
+def query(requests, path=SOCKET_PATH):
+    '''Send a list of requests to a running service and return the responses in order.'''
+    with socket.socket(socket.AF_UNIX) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(requests).encode() + b'\n')
+        stream = connection.makefile('rb')
+        return [json.loads(stream.readline()) for _ in requests]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve M6800 disassembly over a Unix socket')
+    parser.add_argument('--socket', default=SOCKET_PATH, help='path of the Unix socket')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(DisassemblyService().serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
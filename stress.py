@@ -0,0 +1,99 @@
+'''Concurrent stress benchmark for the M6800 architecture callbacks'''
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from binaryninja import Architecture
+
+from .architecture import M6800
+from .ilprofile import RecordingLowLevelILFunction
+from .instructions import INSTRUCTIONS
+from .layout import ROM_START, ROM_SIZE
+
+# Operand bytes tried after every opcode
+OPERAND_SAMPLES = [b'\x00\x00', b'\x10\x20', b'\x7F\xFF', b'\x80\x01', b'\xFE\x58']
+
+# Addresses every instruction is decoded at
+ADDRESS_SAMPLES = [ROM_START, ROM_START + 0x1234, ROM_START + ROM_SIZE - 0x10]
+
+
+def workload():
+    '''Every opcode with every operand sample at every address, as (data, addr) pairs.'''
+    return [(bytes([opcode]) + operands, addr)
+            for opcode in sorted(INSTRUCTIONS)
+            for operands in OPERAND_SAMPLES
+            for addr in ADDRESS_SAMPLES]
+
+
+def run_callbacks(arch, data, addr):
+    '''Call the three architecture callbacks and return a comparable summary.'''
+    tokens, text_length = M6800.get_instruction_text(arch, data, addr)
+    info = M6800.get_instruction_info(arch, data, addr)
+    il = RecordingLowLevelILFunction(arch, addr)
+    il_length = M6800.get_instruction_low_level_il(arch, data, addr, il)
+    return (
+        tuple((token.type, token.text, token.value) for token in tokens), text_length,
+        info.length, tuple((branch.type, branch.target) for branch in info.branches),
+        il_length, tuple(il.operations)
+    )
+
+
+def _hammer(arch, items, expected, rounds):
+    '''Thread body: run the workload rounds times, return (calls, mismatches).'''
+    mismatches = 0
+    for _ in range(rounds):
+        for (data, addr), reference in zip(items, expected):
+            if run_callbacks(arch, data, addr) != reference:
+                mismatches += 1
+    return len(items) * rounds * 3, mismatches
+
+
+def benchmark(thread_counts, rounds, arch=None):
+    '''Return (threads, calls per second, mismatches) for every thread count.
+
+    Every thread runs the whole workload and checks each result against a single threaded
+    reference, so any cross-thread corruption of shared state shows up as a mismatch.
+    '''
+    arch = Architecture[M6800.name] if arch is None else arch
+    items = workload()
+    expected = [run_callbacks(arch, data, addr) for data, addr in items]
+
+    results = []
+    for threads in thread_counts:
+        with ThreadPoolExecutor(threads) as pool:
+            start = time.perf_counter()
+            futures = [pool.submit(_hammer, arch, items, expected, rounds)
+                       for _ in range(threads)]
+            outcomes = [future.result() for future in futures]
+            elapsed = time.perf_counter() - start
+        calls = sum(calls for calls, _ in outcomes)
+        results.append((threads, calls / elapsed, sum(bad for _, bad in outcomes)))
+    return results
+
+
+def report(results):
+    '''Render throughput and scaling relative to the first thread count.'''
+    base_threads, base_rate, _ = results[0]
+    lines = ['threads      calls/s  scaling  efficiency  mismatches']
+    for threads, rate, mismatches in results:
+        scaling = rate / base_rate
+        efficiency = scaling * base_threads / threads
+        lines.append(f'{threads:>7}  {rate:>11.0f}  {scaling:>6.2f}x  {efficiency:>10.0%}  '
+                     f'{mismatches:>10}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hammer the M6800 callbacks from many threads')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--rounds', type=int, default=5, help='workload passes per thread')
+    args = parser.parse_args()
+
+    results = benchmark(args.threads, args.rounds)
+    print(report(results))
+    return 1 if any(mismatches for _, _, mismatches in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,25 @@
+'''Make the plugin importable as the m6800 package without registering it with Binary Ninja'''
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+# the repository is the package, but its __init__ registers the plugin, so load the modules
+# through an empty package pointing at the repository instead
+if 'm6800' not in sys.modules:
+    package = types.ModuleType('m6800')
+    package.__path__ = [str(Path(__file__).resolve().parent.parent)]
+    sys.modules['m6800'] = package
+
+
+@pytest.fixture(name='arch')
+def fixture_arch():
+    '''The registered M6800 architecture, registering it when the plugin is not loaded.'''
+    binaryninja = pytest.importorskip('binaryninja')
+    from m6800.architecture import M6800  # pylint: disable=import-outside-toplevel
+    try:
+        return binaryninja.Architecture[M6800.name]
+    except KeyError:
+        M6800.register()
+        return binaryninja.Architecture[M6800.name]
@@ -0,0 +1,51 @@
+'''Detection of pinball ROM images by the M6800 BinaryView'''
+import pytest
+
+pytest.importorskip('binaryninja')
+
+# pylint: disable=wrong-import-position
+from m6800.binaryview import M6800BinaryView, VALID_CONFIDENCE
+from m6800.layout import ROM_START, VECTORS_START
+from m6800.memory import MEMORY_SIZE
+
+# LDS #$00FF, LDX #$0000, CLR 0,X, INX, CPX #$0200, BNE, LDAA #$01, STAA $10, BRA *
+RESET_CODE = bytes([0x8E, 0x00, 0xFF, 0xCE, 0x00, 0x00, 0x6F, 0x00, 0x08, 0x8C, 0x02, 0x00,
+                    0x26, 0xF8, 0x86, 0x01, 0x97, 0x10, 0x20, 0xFE])
+
+
+class RawData:
+    '''The length and read of a raw BinaryView over a byte string.'''
+
+    def __init__(self, image):
+        self.image = image
+        self.length = len(image)
+
+    def read(self, addr, length):
+        return self.image[addr:addr + length]
+
+
+def confidence(code, reset=ROM_START):
+    image = bytearray(MEMORY_SIZE)
+    image[ROM_START:ROM_START + len(code)] = code
+    image[VECTORS_START:VECTORS_START + 8] = reset.to_bytes(2, 'big') * 4
+    return M6800BinaryView.detection_confidence(RawData(bytes(image)))
+
+
+def test_reset_code_is_detected():
+    assert confidence(RESET_CODE) >= VALID_CONFIDENCE
+
+
+@pytest.mark.parametrize('jump', [bytes([0x7E, 0x58, 0x40]), bytes([0x20, 0x3E])])
+def test_reset_trampoline_is_followed(jump):
+    code = bytearray(0x40 + len(RESET_CODE))
+    code[:len(jump)] = jump
+    code[0x40:] = RESET_CODE
+    assert confidence(bytes(code)) >= VALID_CONFIDENCE
+
+
+def test_early_return_is_not_detected():
+    assert confidence(bytes([0x39])) < VALID_CONFIDENCE
+
+
+def test_text_is_not_detected():
+    assert confidence(b'THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG ' * 8) == 0.0
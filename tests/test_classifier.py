@@ -0,0 +1,52 @@
+'''Code versus data classification around routines reached from the vectors'''
+import pytest
+
+pytest.importorskip('binaryninja')
+
+# pylint: disable=wrong-import-position
+from m6800.cfg import build_cfg
+from m6800.classifier import classify_regions, DATA
+from m6800.layout import ROM_START, ROM_SIZE, VECTORS_START
+
+TABLE_START, TABLE_END = 0x6000, 0x608E
+
+
+def rom():
+    '''Reset calls a routine in zero filled space and one right after a text table.'''
+    image = bytearray(ROM_START + ROM_SIZE)
+    image[0x5800:0x5808] = bytes([0xBD, 0x58, 0x20, 0xBD, 0x60, 0x8E, 0x20, 0xFE])
+    image[0x5820:0x5822] = bytes([0x4F, 0x39])
+    text = b'HELLO WORLD ' * 12
+    image[TABLE_START:TABLE_END] = text[:TABLE_END - TABLE_START]
+    image[TABLE_END:TABLE_END + 2] = bytes([0x4F, 0x39])
+    image[VECTORS_START:VECTORS_START + 8] = bytes([0x58, 0x00] * 4)
+    return bytes(image)
+
+
+def classify(image):
+    instructions = [(inst.addr, inst.length) for function in build_cfg(image).values()
+                    for block in function.blocks.values() for inst in block.instructions]
+    return classify_regions(image[ROM_START:], ROM_START, instructions)
+
+
+def data_at(regions, addr):
+    return any(region.kind == DATA and region.start <= addr < region.end for region in regions)
+
+
+def test_called_routines_are_code():
+    regions = classify(rom())
+    for addr in [0x5800, 0x5820, 0x5821, TABLE_END, TABLE_END + 1]:
+        assert not data_at(regions, addr)
+
+
+def test_data_stops_at_the_next_instruction():
+    regions = classify(rom())
+    table = [region for region in regions if region.start <= TABLE_START < region.end]
+    assert table and table[0].kind == DATA
+    assert table[0].end == TABLE_END
+
+
+def test_regions_cover_the_image():
+    regions = classify(rom())
+    assert regions[0].start == ROM_START and regions[-1].end == ROM_START + ROM_SIZE
+    assert all(left.end == right.start for left, right in zip(regions, regions[1:]))
@@ -0,0 +1,41 @@
+'''Unreached routine candidates found in the gaps of emulator coverage'''
+from array import array
+
+import pytest
+
+pytest.importorskip('binaryninja')
+
+# pylint: disable=wrong-import-position
+from m6800.coverage import candidate_entry_points
+from m6800.layout import ROM_START
+from m6800.memory import MEMORY_SIZE
+
+GAP = ROM_START + 3
+
+
+def candidates(after_return, fill=0xFF):
+    '''Candidates of an image executing LDAA #1, RTS at the ROM start, followed by bytes.'''
+    image = bytearray([fill]) * MEMORY_SIZE
+    image[ROM_START:GAP] = bytes([0x86, 0x01, 0x39])
+    image[GAP:GAP + len(after_return)] = after_return
+    counts = array('I', bytes(4 * MEMORY_SIZE))
+    counts[ROM_START] = counts[ROM_START + 2] = 1
+    return candidate_entry_points(counts, bytes(image))
+
+
+def test_routine_after_return_is_a_candidate():
+    routine = bytes([0x96, 0x10, 0x8B, 0x01, 0x97, 0x10, 0x39])
+    assert candidates(routine) == [GAP]
+
+
+@pytest.mark.parametrize('fill', [0x00, 0xFF])
+def test_padding_is_not_a_candidate(fill):
+    assert candidates(b'', fill) == []
+
+
+def test_text_table_is_not_a_candidate():
+    assert candidates(b'HIGH SCORE TO DATE  GAME OVER  MATCH ' * 16) == []
+
+
+def test_invalid_opcode_soon_after_is_not_a_candidate():
+    assert candidates(bytes([0x4F, 0x02, 0x4F, 0x4F])) == []
@@ -0,0 +1,52 @@
+'''Breakpoints and watchpoints of the emulator debugger'''
+import pytest
+
+pytest.importorskip('binaryninja')
+
+# pylint: disable=wrong-import-position
+from m6800.debugger import Debugger, BREAKPOINT, READ, WRITE
+from m6800.emulator import M6800Emulator, RESET_VECTOR
+from m6800.layout import ROM_START
+from m6800.memory import MEMORY_SIZE
+
+# NOP, LDAA $5808, STAA $10, BRA *, then the byte read
+CODE = bytes([0x01, 0xB6, 0x58, 0x08, 0x97, 0x10, 0x20, 0xFE, 0x42])
+
+
+def debugger():
+    image = bytearray(MEMORY_SIZE)
+    image[ROM_START:ROM_START + len(CODE)] = CODE
+    image[RESET_VECTOR:RESET_VECTOR + 2] = ROM_START.to_bytes(2, 'big')
+    return Debugger(M6800Emulator(bytes(image)))
+
+
+def test_breakpoint_stops_before_the_instruction_and_resumes():
+    debug = debugger()
+    debug.add_breakpoint(ROM_START + 4)
+    assert debug.run(10) == 2
+    assert debug.stop.stops[0].kind == BREAKPOINT
+    assert debug.emulator.regs['PC'] == ROM_START + 4
+    debug.remove_breakpoint(ROM_START + 4)
+    assert debug.run(1) == 1 and debug.emulator.read(0x10) == 0x42
+
+
+def test_read_watch_ignores_instruction_fetches():
+    debug = debugger()
+    for addr in range(ROM_START, ROM_START + 8):
+        debug.watch(addr, read=True, write=False)
+    assert debug.run(10) == 10
+    assert debug.stop is None
+
+
+def test_read_watch_stops_after_the_data_read():
+    debug = debugger()
+    debug.watch(ROM_START + 8, read=True, write=False)
+    assert debug.run(10) == 2
+    assert debug.stop.stops == [(READ, ROM_START + 8, ROM_START + 1, 0x42)]
+
+
+def test_write_watch_reports_the_value():
+    debug = debugger()
+    debug.watch(0x10)
+    assert debug.run(10) == 3
+    assert debug.stop.stops == [(WRITE, 0x10, ROM_START + 4, 0x42)]
@@ -0,0 +1,59 @@
+'''Pairing and change detection of the ROM revision diff'''
+import pytest
+
+pytest.importorskip('binaryninja')
+
+# pylint: disable=wrong-import-position
+from m6800.diff import RomDiff, UNCHANGED, MOVED, CHANGED
+from m6800.layout import VECTORS_START
+from m6800.memory import MEMORY_SIZE
+
+
+def rom(patches=(), routine=0x5820):
+    '''Reset calls a one block routine: LDAA $10, ADDA #1, RTS.'''
+    image = bytearray(MEMORY_SIZE)
+    image[0x5800:0x5805] = bytes([0xBD, routine >> 8, routine & 0xFF, 0x20, 0xFE])
+    image[routine:routine + 5] = bytes([0x96, 0x10, 0x8B, 0x01, 0x39])
+    image[VECTORS_START:VECTORS_START + 8] = bytes([0x58, 0x00] * 4)
+    for addr, value in patches:
+        image[addr] = value
+    return bytes(image)
+
+
+def statuses(old, new):
+    return {(change.old, change.new): change.status for change in RomDiff(old, new).changes()}
+
+
+def test_identical_images_are_unchanged():
+    assert statuses(rom(), rom()) == {(0x5800, 0x5800): UNCHANGED, (0x5820, 0x5820): UNCHANGED}
+
+
+def test_routine_edited_in_place_is_changed():
+    assert statuses(rom(), rom([(0x5823, 0x02)])) == {
+        (0x5800, 0x5800): UNCHANGED, (0x5820, 0x5820): CHANGED}
+
+
+def test_changed_variable_address_is_changed():
+    assert statuses(rom(), rom([(0x5821, 0x12)])) == {
+        (0x5800, 0x5800): UNCHANGED, (0x5820, 0x5820): CHANGED}
+
+
+def test_relocated_callee_is_moved():
+    assert statuses(rom(), rom(routine=0x5840)) == {
+        (0x5800, 0x5800): UNCHANGED, (0x5820, 0x5840): MOVED}
+
+
+def bsr_rom(routine):
+    '''Reset calls a routine that branches to a subroutine staying at 0x5880.'''
+    image = bytearray(MEMORY_SIZE)
+    image[0x5800:0x5805] = bytes([0xBD, routine >> 8, routine & 0xFF, 0x20, 0xFE])
+    offset = (0x5880 - (routine + 2)) & 0xFF
+    image[routine:routine + 7] = bytes([0x8D, offset, 0x96, 0x10, 0x8B, 0x01, 0x39])
+    image[0x5880:0x5883] = bytes([0x86, 0x01, 0x39])
+    image[VECTORS_START:VECTORS_START + 8] = bytes([0x58, 0x00] * 4)
+    return bytes(image)
+
+
+def test_relocated_routine_with_relative_call_is_moved():
+    assert statuses(bsr_rom(0x5820), bsr_rom(0x5830)) == {
+        (0x5800, 0x5800): UNCHANGED, (0x5820, 0x5830): MOVED, (0x5880, 0x5880): UNCHANGED}
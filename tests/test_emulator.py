@@ -0,0 +1,135 @@
+'''Flags, stacking and cycle counts of the M6800 emulator'''
+import pytest
+
+pytest.importorskip('binaryninja')
+
+# pylint: disable=wrong-import-position
+from m6800.emulator import (M6800Emulator, C, V, Z, N, I, H, CCR_UNUSED, MEMORY_SIZE,
+                            RESET_VECTOR, SWI_VECTOR, _cycles)
+from m6800.instructions import AddressMode
+from m6800.layout import ROM_START
+
+ALL_FLAGS = C | V | Z | N | H
+
+
+def emulator(code, swi_handler=b''):
+    '''Emulator reset to code placed at the start of the ROM.'''
+    image = bytearray(MEMORY_SIZE)
+    image[ROM_START:ROM_START + len(code)] = code
+    handler = ROM_START + 0x100
+    image[handler:handler + len(swi_handler)] = swi_handler
+    image[RESET_VECTOR:RESET_VECTOR + 2] = ROM_START.to_bytes(2, 'big')
+    image[SWI_VECTOR:SWI_VECTOR + 2] = handler.to_bytes(2, 'big')
+    return M6800Emulator(bytes(image))
+
+
+def execute(code, **regs):
+    emu = emulator(code)
+    emu.regs.update(regs)
+    emu.ccr = 0
+    emu.step()
+    return emu
+
+
+@pytest.mark.parametrize('accumulator, operand, result, flags', [
+    (0x7F, 0x01, 0x80, N | V | H),
+    (0xFF, 0x01, 0x00, Z | C | H),
+    (0x12, 0x34, 0x46, 0),
+    (0x80, 0x80, 0x00, Z | V | C),
+])
+def test_add_flags(accumulator, operand, result, flags):
+    emu = execute(bytes([0x8B, operand]), ACCA=accumulator)
+    assert emu.regs['ACCA'] == result
+    assert emu.ccr & ALL_FLAGS == flags
+
+
+@pytest.mark.parametrize('accumulator, operand, result, flags', [
+    (0x00, 0x01, 0xFF, N | C),
+    (0x80, 0x01, 0x7F, V),
+    (0x42, 0x42, 0x00, Z),
+    (0x7F, 0xFF, 0x80, N | V | C),
+])
+def test_sub_flags(accumulator, operand, result, flags):
+    emu = execute(bytes([0x80, operand]), ACCA=accumulator)
+    assert emu.regs['ACCA'] == result
+    assert emu.ccr & ALL_FLAGS == flags
+
+
+@pytest.mark.parametrize('left, right, result, carry', [
+    (0x09, 0x08, 0x17, 0),
+    (0x99, 0x01, 0x00, C),
+    (0x58, 0x46, 0x04, C),
+    (0x25, 0x13, 0x38, 0),
+])
+def test_daa_after_add(left, right, result, carry):
+    emu = emulator(bytes([0x8B, right, 0x19]))
+    emu.regs['ACCA'] = left
+    emu.step()
+    emu.step()
+    assert emu.regs['ACCA'] == result
+    assert emu.ccr & C == carry
+    assert bool(emu.ccr & Z) == (result == 0)
+
+
+@pytest.mark.parametrize('index, operand, flags', [
+    (0x1234, 0x1234, Z),
+    (0x8000, 0x0001, N),
+    (0x8000, 0x1000, V),
+    (0x1200, 0x12FF, 0),
+])
+def test_cpx_flags(index, operand, flags):
+    emu = execute(bytes([0x8C]) + operand.to_bytes(2, 'big'), IX=index)
+    assert emu.ccr & (N | Z | V) == flags
+    assert emu.regs['IX'] == index
+
+
+def test_swi_stacks_registers_and_rti_restores_them():
+    emu = emulator(bytes([0x3F, 0x01]), swi_handler=bytes([0x3B]))
+    emu.regs.update(SP=0x0100, IX=0x1234, ACCA=0xAA, ACCB=0xBB)
+    emu.ccr = C | V
+    emu.step()
+
+    assert emu.regs['PC'] == ROM_START + 0x100
+    assert emu.regs['SP'] == 0x00F9
+    assert emu.ccr & I
+    stacked = bytes(emu.read(addr) for addr in range(0x00FA, 0x0101))
+    assert stacked == bytes([C | V | CCR_UNUSED, 0xBB, 0xAA, 0x12, 0x34,
+                             (ROM_START + 1) >> 8, (ROM_START + 1) & 0xFF])
+
+    emu.regs.update(IX=0, ACCA=0, ACCB=0)
+    emu.step()
+    assert emu.regs == dict(emu.regs, PC=ROM_START + 1, SP=0x0100, IX=0x1234,
+                            ACCA=0xAA, ACCB=0xBB)
+    assert emu.ccr == C | V
+
+
+@pytest.mark.parametrize('nmemonic, mode, cycles', [
+    ('NOP', AddressMode.IMPLIED, 2),
+    ('INX', AddressMode.IMPLIED, 4),
+    ('RTS', AddressMode.IMPLIED, 5),
+    ('RTI', AddressMode.IMPLIED, 10),
+    ('SWI', AddressMode.IMPLIED, 12),
+    ('INC', AddressMode.ACCUMULATOR, 2),
+    ('PSH', AddressMode.ACCUMULATOR, 4),
+    ('BRA', AddressMode.RELATIVE, 4),
+    ('BSR', AddressMode.RELATIVE, 8),
+    ('LDA', AddressMode.IMMEDIATE, 2),
+    ('LDA', AddressMode.DIRECT, 3),
+    ('LDA', AddressMode.EXTENDED, 4),
+    ('LDA', AddressMode.INDEXED, 5),
+    ('STA', AddressMode.DIRECT, 4),
+    ('STA', AddressMode.EXTENDED, 5),
+    ('STA', AddressMode.INDEXED, 6),
+    ('CPX', AddressMode.IMMEDIATE, 3),
+    ('LDX', AddressMode.DIRECT, 4),
+    ('STX', AddressMode.EXTENDED, 6),
+    ('STS', AddressMode.INDEXED, 7),
+    ('INC', AddressMode.EXTENDED, 6),
+    ('INC', AddressMode.INDEXED, 7),
+    ('JMP', AddressMode.EXTENDED, 3),
+    ('JMP', AddressMode.INDEXED, 4),
+    ('JSR', AddressMode.EXTENDED, 9),
+    ('JSR', AddressMode.INDEXED, 8),
+])
+def test_cycles(nmemonic, mode, cycles):
+    assert _cycles(nmemonic, mode) == cycles
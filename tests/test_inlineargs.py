@@ -0,0 +1,64 @@
+'''Decoding of calls followed by inline parameter bytes'''
+import pytest
+
+pytest.importorskip('binaryninja')
+
+# pylint: disable=wrong-import-position
+from m6800 import inlineargs
+from m6800.architecture import M6800
+from m6800.cfg import decode
+from m6800.classifier import _sweep
+from m6800.ilprofile import RecordingLowLevelILFunction
+from m6800.inlineargs import SWI, parse_inline_arguments, set_inline_arguments
+from m6800.layout import ROM_START
+from m6800.memory import MEMORY_SIZE
+
+# JSR $6A12 with two parameter bytes, then NOP
+CALL = bytes([0xBD, 0x6A, 0x12, 0xAA, 0xBB, 0x01])
+
+
+@pytest.fixture(autouse=True)
+def table():
+    previous = inlineargs.INLINE_ARGUMENTS
+    set_inline_arguments(parse_inline_arguments('{"0xEA12": 2, "SWI": 1}'))
+    yield
+    set_inline_arguments(previous)
+
+
+def test_keys_are_masked_into_the_address_space():
+    assert inlineargs.INLINE_ARGUMENTS == {0x6A12: 2, SWI: 1}
+
+
+def test_instruction_info_skips_the_parameters(arch):
+    def length(code):
+        return M6800.get_instruction_info(arch, code, ROM_START).length
+
+    assert length(CALL) == 5
+    assert length(bytes([0x3F, 0x07, 0x01])) == 2
+    assert length(bytes([0xBD, 0x6A, 0x00, 0x01])) == 3
+
+
+def test_instruction_text_shows_the_parameters(arch):
+    tokens, length = M6800.get_instruction_text(arch, CALL, ROM_START)
+    assert length == 5
+    assert [token.text for token in tokens] == ['JSR', ' ', '0x6A12', ' {', '0xAA', ', ',
+                                                '0xBB', '}']
+
+
+def test_lifted_length_includes_the_parameters(arch):
+    il = RecordingLowLevelILFunction(arch, ROM_START)
+    assert M6800.get_instruction_low_level_il(arch, CALL, ROM_START, il) == 5
+    assert 'call' in il.operations
+
+
+def test_cfg_decode_includes_the_parameters():
+    image = bytearray(MEMORY_SIZE)
+    image[ROM_START:ROM_START + len(CALL)] = CALL
+    inst = decode(bytes(image), ROM_START)
+    assert inst.length == 5 and inst.data == CALL[:5]
+
+
+def test_sweep_steps_over_the_parameters():
+    starts, invalid, _, _ = _sweep(CALL, ROM_START)
+    assert list(starts) == [1, 0, 0, 0, 0, 1]
+    assert not any(invalid)
@@ -0,0 +1,58 @@
+'''Periodic IRQ, PIA stand-ins and their snapshots'''
+import pytest
+
+pytest.importorskip('binaryninja')
+
+# pylint: disable=wrong-import-position
+from m6800.emulator import M6800Emulator, IRQ_VECTOR, RESET_VECTOR
+from m6800.farm import run_script
+from m6800.layout import ROM_START
+from m6800.memory import MEMORY_SIZE
+from m6800.peripherals import attach_williams_io, IRQ_PERIOD, PIA_ADDRESSES
+
+HANDLER = ROM_START + 0x20
+
+
+def machine():
+    '''Reset enables interrupts and spins, the IRQ handler counts into $10.'''
+    image = bytearray(MEMORY_SIZE)
+    image[ROM_START:ROM_START + 6] = bytes([0x8E, 0x00, 0xFF, 0x0E, 0x20, 0xFE])
+    image[HANDLER:HANDLER + 4] = bytes([0x7C, 0x00, 0x10, 0x3B])
+    image[RESET_VECTOR:RESET_VECTOR + 2] = ROM_START.to_bytes(2, 'big')
+    image[IRQ_VECTOR:IRQ_VECTOR + 2] = HANDLER.to_bytes(2, 'big')
+    emulator = M6800Emulator(bytes(image))
+    return emulator, attach_williams_io(emulator)
+
+
+def test_periodic_irq_runs_the_handler():
+    emulator, io = machine()
+    io.scheduler.run(emulator, 10 * IRQ_PERIOD + 100)
+    assert emulator.read(0x10) == 10
+
+
+def test_snapshot_restores_devices_and_timer():
+    emulator, io = machine()
+    io.scheduler.run(emulator, 3 * IRQ_PERIOD + 100)
+    emulator.write(PIA_ADDRESSES['lamps'] + 1, 0x04)
+    emulator.write(PIA_ADDRESSES['lamps'], 0x5A)
+    io.switches.set_switch(2, 3)
+    state, io_state = emulator.snapshot(), io.snapshot()
+
+    io.scheduler.run(emulator, 5 * IRQ_PERIOD)
+    emulator.write(PIA_ADDRESSES['lamps'], 0xA5)
+    io.switches.set_switch(2, 3, closed=False)
+    emulator.restore(state)
+    io.restore(io_state)
+
+    assert io.snapshot() == io_state
+    assert io.pias['lamps'].data[0] == 0x5A and io.switches.closed[2] == 1 << 3
+    io.scheduler.run(emulator, 2 * IRQ_PERIOD)
+    assert emulator.read(0x10) == 5
+
+
+def test_script_switches_and_reads():
+    emulator, io = machine()
+    reads = run_script(emulator, io, [('run', 4 * IRQ_PERIOD + 100), ('switch', 0, 1, True),
+                                      ('read', 0x10, 1)])
+    assert reads == [bytes([4])]
+    assert io.switches.closed[0] == 0x02
@@ -0,0 +1,129 @@
+'''Lifting of ACCB then ACCA instruction pairs as single operations on D'''
+import pytest
+
+pytest.importorskip('binaryninja')
+
+# pylint: disable=wrong-import-position
+from m6800.architecture import M6800
+from m6800.ilprofile import RecordingLowLevelILFunction
+from m6800.layout import ROM_START
+
+NOP, TSTA, DAA, BEQ = b'\x01', b'\x4D', b'\x19', b'\x27\x10'
+
+
+class Recorder(RecordingLowLevelILFunction):
+    '''Keeps the arguments of every expression, and has labels at the given addresses.'''
+
+    def __init__(self, arch, labels=()):
+        super().__init__(arch, ROM_START)
+        self.labels = set(labels)
+        self.calls = []
+
+    def get_label_for_address(self, unused_arch, addr):
+        return addr if addr in self.labels else None
+
+    def __getattr__(self, operation):
+        build = super().__getattr__(operation)
+
+        def record(*args, **kwargs):
+            self.calls.append((operation, args, kwargs.get('flags')))
+            return build(*args, **kwargs)
+        return record
+
+    def find(self, operation, *args):
+        '''Index of the first expression built by operation with args, or None.'''
+        for index, (name, call_args, _) in enumerate(self.calls):
+            if name == operation and call_args[:len(args)] == args:
+                return index
+        return None
+
+
+def lift(arch, code, labels=()):
+    il = Recorder(arch, labels)
+    length = M6800.get_instruction_low_level_il(arch, code + b'\x01' * 4, ROM_START, il)
+    return length, il
+
+
+def word_operand(il, mode):
+    '''Index of the expression the fused operation reads for each address mode.'''
+    if mode == 'immediate':
+        return il.find('const', 2, 0x1234)
+    if mode == 'indexed':
+        return il.find('load', 2, il.find('add', 2, il.find('reg', 2, 'IX')))
+    return il.find('load', 2, il.find('const', 2, 0x10 if mode == 'direct' else 0x1234))
+
+
+ARITHMETIC = {
+    'add': {'immediate': 'CB 34 89 12', 'direct': 'DB 11 99 10', 'extended': 'FB 12 35 B9 12 34',
+            'indexed': 'EB 05 A9 04'},
+    'sub': {'immediate': 'C0 34 82 12', 'direct': 'D0 11 92 10', 'extended': 'F0 12 35 B2 12 34',
+            'indexed': 'E0 05 A2 04'},
+}
+
+
+@pytest.mark.parametrize('operation, mode', [(operation, mode) for operation in ARITHMETIC
+                                             for mode in ARITHMETIC[operation]])
+def test_arithmetic_pairs_fuse(arch, operation, mode):
+    code = bytes.fromhex(ARITHMETIC[operation][mode])
+    length, il = lift(arch, code + TSTA)
+    assert length == len(code)
+    operand = word_operand(il, mode)
+    assert operand is not None
+    combined = il.find(operation, 2, il.find('reg', 2, 'D'), operand)
+    assert combined is not None and il.calls[combined][2] == 'NVC'
+    assert il.find('set_reg', 2, 'D', combined) is not None
+    # TSTA rewrites Z, so the high byte Z is not computed
+    assert il.find('set_flag') is None
+
+
+def test_arithmetic_pair_sets_z_when_it_is_observed(arch):
+    length, il = lift(arch, bytes.fromhex('CB 34 89 12') + BEQ)
+    assert length == 4
+    assert il.find('set_flag', 'Z') is not None
+
+
+@pytest.mark.parametrize('code', ['96 10 D6 11', 'D6 11 96 10'])
+def test_load_pairs_fuse_in_either_order(arch, code):
+    code = bytes.fromhex(code)
+    length, il = lift(arch, code + TSTA)
+    assert length == 4
+    load = il.find('load', 2, il.find('const', 2, 0x10))
+    assert load is not None and il.find('set_reg', 2, 'D', load) is not None
+
+
+@pytest.mark.parametrize('code', ['97 10 D7 11', 'D7 11 97 10'])
+def test_store_pairs_fuse_in_either_order(arch, code):
+    code = bytes.fromhex(code)
+    length, il = lift(arch, code + TSTA)
+    assert length == 4
+    address = il.find('const', 2, 0x10)
+    assert il.find('store', 2, address, il.find('reg', 2, 'D')) is not None
+
+
+def test_immediate_load_pair_fuses(arch):
+    length, il = lift(arch, bytes.fromhex('86 12 C6 34') + TSTA)
+    assert length == 4
+    assert il.find('set_reg', 2, 'D', il.find('const', 2, 0x1234)) is not None
+
+
+@pytest.mark.parametrize('code, labels', [
+    # DAA reads the half carry of the high byte addition
+    (bytes.fromhex('CB 34 89 12') + DAA, ()),
+    # BEQ reads Z of the second load, which the word load does not compute
+    (bytes.fromhex('96 10 D6 11') + BEQ, ()),
+    (bytes.fromhex('97 10 D7 11') + NOP, ()),
+    # the second instruction is a branch target
+    (bytes.fromhex('CB 34 89 12') + TSTA, (ROM_START + 2,)),
+    (bytes.fromhex('96 10 D6 11') + TSTA, (ROM_START + 2,)),
+    # the bytes are not adjacent
+    (bytes.fromhex('DB 12 99 10') + TSTA, ()),
+    (bytes.fromhex('96 10 D6 12') + TSTA, ()),
+    (bytes.fromhex('EB 04 A9 04') + TSTA, ()),
+    # the high byte comes first, or both halves use the same accumulator
+    (bytes.fromhex('8B 12 C9 34') + TSTA, ()),
+    (bytes.fromhex('96 10 96 11') + TSTA, ()),
+])
+def test_pairs_that_must_not_fuse(arch, code, labels):
+    length, il = lift(arch, code, labels)
+    assert length == 2
+    assert il.find('reg', 2, 'D') is None and il.find('set_reg', 2, 'D') is None